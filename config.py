@@ -1,92 +1,254 @@
-from typing import Optional
+import threading
+from dataclasses import dataclass, fields, replace
+from typing import Callable, Dict, List, Optional
 from PyQt6.QtCore import QSettings
 from models import KeyboardDevice
 
 
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """Immutable view of all settings. Field names match the QSettings keys."""
+    last_keyboard_path: str = ""
+    last_keyboard_name: str = ""
+    auto_select_last: bool = True
+    auto_start_monitoring: bool = False
+    script_timeout: int = 5
+    minimize_to_tray: bool = True
+    shown_minimize_to_tray_message: bool = False
+    start_minimized: bool = False
+    editor_path: str = ""
+    debounce_ms: int = 0
+    passthrough_unbound: bool = False
+    lua_memory_limit_mb: int = 0
+    journal_enabled: bool = False
+    active_profile: str = "default"
+    profile_switch_key: str = ""
+    capture_events: bool = False
+    realtime_mode: bool = False
+
+
+ConfigListener = Callable[[ConfigSnapshot, str], None]
+
+
 class ConfigManager:
-    """Manages configuration using QSettings."""
+    """
+    Manages configuration using QSettings.
+
+    All settings are held in an immutable ConfigSnapshot. Readers (including the
+    monitor thread) only dereference the current snapshot and never touch QSettings.
+    Writers swap in a new snapshot, notify subscribers and schedule a debounced
+    write that is persisted from a background timer thread.
+    """
+
+    ORGANIZATION = "MacroTinyKeyB"
+    APPLICATION = "MacroTinyKeyB"
+    PERSIST_DELAY = 0.5  # seconds to wait for further changes before writing
 
     def __init__(self):
-        self.settings = QSettings("MacroTinyKeyB", "MacroTinyKeyB")
+        self.settings = QSettings(self.ORGANIZATION, self.APPLICATION)
+        self._snapshot = self._load_snapshot()
+        self._write_lock = threading.Lock()
+        self._pending: Dict[str, object] = {}
+        self._persist_timer: Optional[threading.Timer] = None
+        self._listeners: List[ConfigListener] = []
+
+    def _load_snapshot(self) -> ConfigSnapshot:
+        """Read every setting from QSettings once."""
+        defaults = ConfigSnapshot()
+        values = {}
+        for field in fields(ConfigSnapshot):
+            default = getattr(defaults, field.name)
+            values[field.name] = self.settings.value(field.name, default, type=type(default))
+        return ConfigSnapshot(**values)
+
+    @property
+    def snapshot(self) -> ConfigSnapshot:
+        """The current configuration. Safe to read from any thread without locking."""
+        return self._snapshot
+
+    def subscribe(self, listener: ConfigListener) -> None:
+        """Register a callback invoked as listener(snapshot, key) after every change."""
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener: ConfigListener) -> None:
+        """Remove a previously registered change callback."""
+        try:
+            self._listeners.remove(listener)
+        except ValueError:
+            pass
+
+    def _update(self, **changes) -> None:
+        """Swap in a new snapshot, schedule persistence and notify listeners."""
+        with self._write_lock:
+            current = self._snapshot
+            changed = {key: value for key, value in changes.items() if getattr(current, key) != value}
+            if not changed:
+                return
+            self._snapshot = replace(current, **changed)
+            self._pending.update(changed)
+            self._schedule_persist()
+            snapshot = self._snapshot
+
+        for key in changed:
+            for listener in list(self._listeners):
+                listener(snapshot, key)
+
+    def _schedule_persist(self) -> None:
+        """(Re)start the debounce timer. Caller must hold the write lock."""
+        if self._persist_timer is not None:
+            self._persist_timer.cancel()
+        self._persist_timer = threading.Timer(self.PERSIST_DELAY, self._persist)
+        self._persist_timer.daemon = True
+        self._persist_timer.start()
+
+    def _persist(self) -> None:
+        """Write pending changes to disk. QSettings objects are per-thread, so use a fresh one."""
+        with self._write_lock:
+            pending, self._pending = self._pending, {}
+            self._persist_timer = None
+        if not pending:
+            return
+
+        settings = QSettings(self.ORGANIZATION, self.APPLICATION)
+        for key, value in pending.items():
+            settings.setValue(key, value)
+        settings.sync()
+
+    def flush(self) -> None:
+        """Persist pending changes immediately (e.g. on application exit)."""
+        with self._write_lock:
+            if self._persist_timer is not None:
+                self._persist_timer.cancel()
+                self._persist_timer = None
+        self._persist()
 
     def get_last_keyboard(self) -> Optional[KeyboardDevice]:
         """Get the last selected keyboard if it exists."""
-        path = self.settings.value("last_keyboard_path", None)
-        name = self.settings.value("last_keyboard_name", None)
-
-        if path and name:
-            return KeyboardDevice(path=path, name=name)
+        snapshot = self._snapshot
+        if snapshot.last_keyboard_path and snapshot.last_keyboard_name:
+            return KeyboardDevice(path=snapshot.last_keyboard_path, name=snapshot.last_keyboard_name)
         return None
 
     def set_last_keyboard(self, keyboard: KeyboardDevice) -> None:
         """Save the last selected keyboard."""
-        self.settings.setValue("last_keyboard_path", keyboard.path)
-        self.settings.setValue("last_keyboard_name", keyboard.name)
+        self._update(last_keyboard_path=keyboard.path, last_keyboard_name=keyboard.name)
 
     def should_auto_select(self) -> bool:
         """Check if auto-selection is enabled."""
-        return self.settings.value("auto_select_last", True, type=bool)
+        return self._snapshot.auto_select_last
 
     def set_auto_select(self, enabled: bool) -> None:
         """Set auto-selection preference."""
-        self.settings.setValue("auto_select_last", enabled)
+        self._update(auto_select_last=enabled)
 
     def should_auto_start_monitoring(self) -> bool:
         """Check if auto-start monitoring is enabled."""
-        return self.settings.value("auto_start_monitoring", False, type=bool)
+        return self._snapshot.auto_start_monitoring
 
     def set_auto_start_monitoring(self, enabled: bool) -> None:
         """Set auto-start monitoring preference."""
-        self.settings.setValue("auto_start_monitoring", enabled)
+        self._update(auto_start_monitoring=enabled)
 
     def get_script_timeout(self) -> int:
         """Get the script execution timeout."""
-        return self.settings.value("script_timeout", 5, type=int)
+        return self._snapshot.script_timeout
 
     def set_script_timeout(self, timeout: int) -> None:
         """Set script execution timeout."""
-        self.settings.setValue("script_timeout", timeout)
+        self._update(script_timeout=timeout)
 
     def should_minimize_to_tray(self) -> bool:
         """Check if minimize to tray is enabled."""
-        return self.settings.value("minimize_to_tray", True, type=bool)
+        return self._snapshot.minimize_to_tray
 
     def set_minimize_to_tray(self, enabled: bool) -> None:
         """Set minimize to tray preference."""
-        self.settings.setValue("minimize_to_tray", enabled)
+        self._update(minimize_to_tray=enabled)
 
     def has_shown_minimize_to_tray_message(self) -> bool:
         """Check if the minimize to tray message has been shown."""
-        return self.settings.value("shown_minimize_to_tray_message", False, type=bool)
+        return self._snapshot.shown_minimize_to_tray_message
 
     def set_shown_minimize_to_tray_message(self, shown: bool) -> None:
         """Set whether the minimize to tray message has been shown."""
-        self.settings.setValue("shown_minimize_to_tray_message", shown)
+        self._update(shown_minimize_to_tray_message=shown)
 
     def should_start_minimized(self) -> bool:
         """Check if the application should start minimized."""
-        return self.settings.value("start_minimized", False, type=bool)
+        return self._snapshot.start_minimized
 
     def set_start_minimized(self, enabled: bool) -> None:
         """Set the preference for starting the application minimized."""
-        self.settings.setValue("start_minimized", enabled)
+        self._update(start_minimized=enabled)
 
-    def get_editor_path(self) -> str:
-        """Get the configured editor path."""
-        return self.settings.value("editor_path", "")
+    def get_debounce_ms(self) -> int:
+        """Get the per-key debounce window in milliseconds (0 disables debouncing)."""
+        return self._snapshot.debounce_ms
+
+    def set_debounce_ms(self, window_ms: int) -> None:
+        """Set the per-key debounce window in milliseconds."""
+        self._update(debounce_ms=window_ms)
+
+    def should_passthrough_unbound(self) -> bool:
+        """Check if keys without a script are forwarded instead of swallowed."""
+        return self._snapshot.passthrough_unbound
+
+    def set_passthrough_unbound(self, enabled: bool) -> None:
+        """Set whether keys without a script are forwarded to a virtual keyboard."""
+        self._update(passthrough_unbound=enabled)
+
+    def get_lua_memory_limit(self) -> int:
+        """Get the Lua runtime memory limit in megabytes (0 = unlimited)."""
+        return self._snapshot.lua_memory_limit_mb
+
+    def set_lua_memory_limit(self, limit_mb: int) -> None:
+        """Set the Lua runtime memory limit in megabytes."""
+        self._update(lua_memory_limit_mb=limit_mb)
+
+    def should_write_journal(self) -> bool:
+        """Check if key events and macro results are written to the event journal."""
+        return self._snapshot.journal_enabled
+
+    def set_write_journal(self, enabled: bool) -> None:
+        """Set whether the event journal is written."""
+        self._update(journal_enabled=enabled)
+
+    def get_active_profile(self) -> str:
+        """Get the name of the macro profile that was active last."""
+        return self._snapshot.active_profile
+
+    def set_active_profile(self, name: str) -> None:
+        """Remember the active macro profile."""
+        self._update(active_profile=name)
+
+    def get_profile_switch_key(self) -> str:
+        """Get the key (script name, e.g. "f12") that cycles profiles; empty if none."""
+        return self._snapshot.profile_switch_key
+
+    def set_profile_switch_key(self, key_name: str) -> None:
+        """Set the key that cycles profiles."""
+        self._update(profile_switch_key=key_name)
+
+    def should_capture_events(self) -> bool:
+        """Check if the raw event stream is captured to a file while monitoring."""
+        return self._snapshot.capture_events
 
-    def set_editor_path(self, editor_path: str) -> None:
-        """Set the editor path."""
-        self.settings.setValue("editor_path", editor_path)
+    def set_capture_events(self, enabled: bool) -> None:
+        """Set whether raw events are captured while monitoring."""
+        self._update(capture_events=enabled)
 
+    def should_use_realtime(self) -> bool:
+        """Check if the monitor thread asks for realtime scheduling and locked memory."""
+        return self._snapshot.realtime_mode
 
-    # Extension for ConfigManager class - add these methods to your existing ConfigManager
+    def set_realtime(self, enabled: bool) -> None:
+        """Set whether the monitor thread runs in realtime mode (applies when monitoring starts)."""
+        self._update(realtime_mode=enabled)
 
     def get_editor_path(self) -> str:
         """Get the configured text editor path."""
-        return self.settings.value("editor_path", "", type=str)
+        return self._snapshot.editor_path
 
-    def set_editor_path(self, path: str):
+    def set_editor_path(self, path: str) -> None:
         """Set the text editor path."""
-        self.settings.setValue("editor_path", path)
-        self.settings.sync()
\ No newline at end of file
+        self._update(editor_path=path)
@@ -8,8 +8,16 @@ class MacroDirectoryManager:
         self.base_name = base_name
         self.config_dir = Path.home() / ".config" / base_name
         self.keys_dir = self.config_dir / "scripts"
+        self.recordings_dir = self.config_dir / "recordings"
+        self.profiles_dir = self.config_dir / "profiles"
+        self.captures_dir = self.config_dir / "captures"
+        self.lib_dir = self.config_dir / "lib"
     
     def setup_directories(self) -> Tuple[Path, Path]:
         """Create necessary directories for the macro system."""
         self.keys_dir.mkdir(parents=True, exist_ok=True)
+        self.recordings_dir.mkdir(parents=True, exist_ok=True)
+        self.profiles_dir.mkdir(parents=True, exist_ok=True)
+        self.captures_dir.mkdir(parents=True, exist_ok=True)
+        self.lib_dir.mkdir(parents=True, exist_ok=True)
         return self.config_dir, self.keys_dir
@@ -0,0 +1,222 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import List, Optional
+
+
+class JournalRecord:
+    """One queued journal entry. Records are recycled through the journal's pool."""
+
+    __slots__ = ("kind", "event_us", "keycode", "script", "latency_us", "duration_us", "status", "output")
+
+    def __init__(self):
+        self.kind = ""
+        self.event_us = 0
+        self.keycode = ""
+        self.script = ""
+        self.latency_us = 0
+        self.duration_us = 0
+        self.status = ""
+        self.output = ""
+
+
+class EventJournal:
+    """
+    Structured JSONL journal of key events and macro results.
+
+    record() only fills a pooled record and appends it to a deque, so the monitor
+    thread never waits for the disk and allocates nothing per event. A background
+    writer drains the deque in batches, returns the records to the pool, fsyncs at
+    most once per FSYNC_INTERVAL and rotates the file when it grows past max_bytes.
+
+    If the disk fails the writer keeps running: the entries it could not write are
+    dropped and the error is kept for take_errors(). At most MAX_QUEUED entries wait
+    in the queue; record() drops further ones until the writer catches up.
+    """
+
+    FILENAME = "journal.jsonl"
+    FLUSH_INTERVAL = 0.25  # seconds between writer wake-ups
+    FSYNC_INTERVAL = 2.0  # seconds between fsyncs
+    OUTPUT_LIMIT = 200  # characters of script output kept per record
+    POOL_SIZE = 256  # preallocated records; more are created only during bursts
+    MAX_QUEUED = 20000  # entries waiting for the writer before record() drops new ones
+
+    def __init__(self, directory: Path, max_bytes: int = 5 * 1024 * 1024, backups: int = 5):
+        self.directory = directory
+        self.path = directory / self.FILENAME
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._queue = deque()
+        self._pool = deque(JournalRecord() for _ in range(self.POOL_SIZE))
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self._file = None
+        self._last_fsync = 0.0
+        self.dropped = 0  # entries record() dropped because the queue was full
+        self.lost = 0  # entries the writer could not write
+        self._dropped_reported = 0
+        self._failing = False  # the last write failed
+        self._errors = deque()  # messages for take_errors(), appended by the writer thread
+
+    def start(self) -> None:
+        """Start the background writer."""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._writer_loop, name="EventJournalWriter", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Write everything still queued and stop the writer."""
+        if not self._running:
+            return
+        self._running = False
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+
+    def record(self, kind: str, event_us: int, keycode: str, script: str = "",
+               latency_us: int = 0, duration_us: int = 0, status: str = "", output: str = "") -> None:
+        """Queue one journal entry. Safe to call from any thread; never blocks on I/O."""
+        if len(self._queue) >= self.MAX_QUEUED:
+            self.dropped += 1
+            return
+        try:
+            entry = self._pool.pop()
+        except IndexError:
+            entry = JournalRecord()
+        entry.kind = kind
+        entry.event_us = event_us
+        entry.keycode = keycode
+        entry.script = script
+        entry.latency_us = latency_us
+        entry.duration_us = duration_us
+        entry.status = status
+        entry.output = output
+        self._queue.append(entry)
+
+    def take_errors(self) -> List[str]:
+        """Return and forget the write errors reported since the last call."""
+        errors = []
+        while self._errors:
+            errors.append(self._errors.popleft())
+        return errors
+
+    def _writer_loop(self) -> None:
+        """Drain the queue until stopped, then drain once more."""
+        try:
+            while self._running:
+                self._wakeup.wait(self.FLUSH_INTERVAL)
+                self._wakeup.clear()
+                self._write_batch()
+            self._write_batch()
+            if not self._failing:
+                self._sync(force=True)
+        except OSError as e:
+            self._errors.append(f"Could not write event journal {self.path}: {e}")
+        finally:
+            self._close_file()
+
+    def _close_file(self) -> None:
+        """Close the journal file, ignoring errors of a file that already failed."""
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+    def _write_batch(self) -> None:
+        """Format and write all queued entries. Write errors are reported, not raised."""
+        if self.dropped != self._dropped_reported:
+            self._errors.append(f"Event journal queue full, dropped {self.dropped - self._dropped_reported} entries")
+            self._dropped_reported = self.dropped
+        if not self._queue:
+            return
+
+        lines = []
+        queue = self._queue
+        pool = self._pool
+        while queue:
+            record = queue.popleft()
+            entry = {"ts": record.event_us, "kind": record.kind, "key": record.keycode}
+            if record.script:
+                entry["script"] = record.script
+            if record.kind == "key":
+                entry["state"] = record.status
+            elif record.kind in ("macro", "timer"):
+                entry["lat_us"] = record.latency_us
+                entry["dur_us"] = record.duration_us
+                entry["status"] = record.status
+                entry["output"] = record.output[:self.OUTPUT_LIMIT]
+            record.output = ""  # do not keep script output alive in the pool
+            if len(pool) < self.POOL_SIZE:
+                pool.append(record)
+            lines.append((json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8"))
+
+        try:
+            self._write_lines(lines)
+        except OSError as e:
+            self.lost += len(lines)
+            if not self._failing:
+                self._errors.append(f"Could not write event journal {self.path}, dropping entries: {e}")
+            self._failing = True
+            self._close_file()  # reopened by the next batch
+            return
+        if self._failing:
+            self._failing = False
+            self._errors.append(f"Event journal writable again; {self.lost} entries lost so far")
+
+    def _write_lines(self, lines: List[bytes]) -> None:
+        """Append encoded lines, rotating whenever the next one would take the file past max_bytes."""
+        if self._file is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, "ab")
+        size = self._file.tell()
+        chunk = []
+        for line in lines:
+            if size + len(line) > self.max_bytes and size > 0:
+                self._file.write(b"".join(chunk))
+                chunk = []
+                self._rotate()
+                size = 0
+            chunk.append(line)
+            size += len(line)
+        self._file.write(b"".join(chunk))
+        self._file.flush()
+        self._sync()
+
+    def _sync(self, force: bool = False) -> None:
+        """fsync the journal if the interval has elapsed."""
+        now = time.monotonic()
+        if self._file is not None and (force or now - self._last_fsync >= self.FSYNC_INTERVAL):
+            os.fsync(self._file.fileno())
+            self._last_fsync = now
+
+    def _rotate(self) -> None:
+        """Shift journal.N.jsonl to journal.N+1.jsonl and start a fresh journal file."""
+        self._file.flush()
+        self._sync(force=True)
+        self._file.close()
+        for index in range(self.backups - 1, 0, -1):
+            source = self.rotated_path(index)
+            if source.exists():
+                source.replace(self.rotated_path(index + 1))
+        if self.backups > 0:
+            self.path.replace(self.rotated_path(1))
+        else:
+            self.path.unlink()
+        self._file = open(self.path, "ab")
+
+    def rotated_path(self, index: int) -> Path:
+        """Path of the index-th rotated journal file."""
+        return self.directory / f"journal.{index}.jsonl"
+
+    def files(self) -> List[Path]:
+        """All existing journal files, oldest first."""
+        rotated = [self.rotated_path(index) for index in range(self.backups, 0, -1)]
+        return [path for path in rotated + [self.path] if path.exists()]
@@ -7,36 +7,49 @@ from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                              QHBoxLayout, QTextEdit, QComboBox, QPushButton,
                              QLabel, QSystemTrayIcon, QMenu, QMessageBox,
                              QSplitter, QGroupBox, QCheckBox, QSpinBox, QFrame,
-                             QGridLayout, QTabWidget, QLineEdit, QFileDialog)
+                             QGridLayout, QTabWidget, QLineEdit, QFileDialog, QDoubleSpinBox)
 from PyQt6.QtCore import QThread, pyqtSignal, QTimer, Qt, QSettings
-from PyQt6.QtGui import QIcon, QFont, QPixmap, QPainter, QColor, QAction, QTextCursor
+from PyQt6.QtGui import QIcon, QFont, QPixmap, QPainter, QColor, QAction, QActionGroup, QTextCursor
 
 from config import ConfigManager
 from directories import MacroDirectoryManager
 from lua_manager import LuaScriptManager
 from keyboard_scanner import KeyboardScanner
 from keyboard_monitor import KeyboardMonitorThread
+from macro_recorder import MacroRecorderThread
+from event_journal import EventJournal
+from input_sources import CAPTURE_EXTENSION, ReplayInputSource
 from models import KeyboardDevice
 
 
 class MainWindow(QMainWindow):
     """Main application window."""
 
+    profile_switched = pyqtSignal(str)  # emitted from whichever thread switched the profile
+
     def __init__(self):
         super().__init__()
 
         self.config_manager = ConfigManager()
         self.dir_manager = MacroDirectoryManager()
         self.config_dir, self.keys_dir = self.dir_manager.setup_directories()
-        self.script_manager = LuaScriptManager(self.keys_dir, self.config_manager.get_script_timeout())
+        self.recordings_dir = self.dir_manager.recordings_dir
+        self.captures_dir = self.dir_manager.captures_dir
+        self.script_manager = LuaScriptManager(self.keys_dir, self.config_manager.get_script_timeout(),
+                                               self.recordings_dir, self.config_manager.get_lua_memory_limit(),
+                                               self.dir_manager.profiles_dir, self.dir_manager.lib_dir)
         self.keyboard_scanner = KeyboardScanner()
         self.monitor_thread = None
+        self.recorder_thread = None
+        self.journal = None
+        self.config_manager.subscribe(self.on_config_changed)
 
         # Start minimized if enabled
         if self.config_manager.should_start_minimized():
             QTimer.singleShot(0, self.hide)
 
         self.init_ui()
+        self.load_profiles()
         self.init_tray()
         self.load_keyboards()
 
@@ -114,6 +127,19 @@ class MainWindow(QMainWindow):
         timeout_widget.setLayout(timeout_layout)
         settings_layout.addWidget(timeout_widget, 1, 1)
 
+        debounce_layout = QHBoxLayout()
+        debounce_layout.addWidget(QLabel("Debounce (ms, 0 = off):"))
+        self.debounce_spin = QSpinBox()
+        self.debounce_spin.setRange(0, 200)
+        self.debounce_spin.setValue(self.config_manager.get_debounce_ms())
+        self.debounce_spin.valueChanged.connect(self.config_manager.set_debounce_ms)
+        debounce_layout.addWidget(self.debounce_spin)
+        debounce_layout.addStretch()
+
+        debounce_widget = QWidget()
+        debounce_widget.setLayout(debounce_layout)
+        settings_layout.addWidget(debounce_widget, 1, 2)
+
         # Row 3 - Editor Path Setting
         settings_layout.addWidget(QLabel("Editor Path:"), 2, 0)
 
@@ -132,6 +158,50 @@ class MainWindow(QMainWindow):
         editor_widget.setLayout(editor_layout)
         settings_layout.addWidget(editor_widget, 2, 1, 1, 2)
 
+        # Row 4
+        self.passthrough_cb = QCheckBox("Forward keys without a script (no templates are created)")
+        self.passthrough_cb.setChecked(self.config_manager.should_passthrough_unbound())
+        self.passthrough_cb.toggled.connect(self.config_manager.set_passthrough_unbound)
+        settings_layout.addWidget(self.passthrough_cb, 3, 0, 1, 2)
+
+        memory_layout = QHBoxLayout()
+        memory_layout.addWidget(QLabel("Lua memory limit (MB, 0 = off):"))
+        self.memory_limit_spin = QSpinBox()
+        self.memory_limit_spin.setRange(0, 4096)
+        self.memory_limit_spin.setValue(self.config_manager.get_lua_memory_limit())
+        self.memory_limit_spin.valueChanged.connect(self.config_manager.set_lua_memory_limit)
+        memory_layout.addWidget(self.memory_limit_spin)
+        memory_layout.addStretch()
+
+        memory_widget = QWidget()
+        memory_widget.setLayout(memory_layout)
+        settings_layout.addWidget(memory_widget, 3, 2)
+
+        profile_key_layout = QHBoxLayout()
+        profile_key_layout.addWidget(QLabel("Profile switch key:"))
+        self.profile_key_line = QLineEdit()
+        self.profile_key_line.setPlaceholderText("e.g. f12")
+        self.profile_key_line.setText(self.config_manager.get_profile_switch_key())
+        self.profile_key_line.textChanged.connect(
+            lambda text: self.config_manager.set_profile_switch_key(text.strip().lower()))
+        profile_key_layout.addWidget(self.profile_key_line)
+
+        profile_key_widget = QWidget()
+        profile_key_widget.setLayout(profile_key_layout)
+        settings_layout.addWidget(profile_key_widget, 4, 2)
+
+        # Row 5
+        self.journal_cb = QCheckBox("Write event journal (journal.jsonl in config folder)")
+        self.journal_cb.setChecked(self.config_manager.should_write_journal())
+        self.journal_cb.toggled.connect(self.config_manager.set_write_journal)
+        settings_layout.addWidget(self.journal_cb, 4, 0, 1, 2)
+
+        # Row 6
+        self.realtime_cb = QCheckBox("Realtime mode: high priority monitor thread (applies when monitoring starts)")
+        self.realtime_cb.setChecked(self.config_manager.should_use_realtime())
+        self.realtime_cb.toggled.connect(self.config_manager.set_realtime)
+        settings_layout.addWidget(self.realtime_cb, 5, 0, 1, 3)
+
         settings_layout.setColumnStretch(0, 1)
         settings_layout.setColumnStretch(1, 1)
         main_layout.addWidget(settings_group)
@@ -165,6 +235,48 @@ class MainWindow(QMainWindow):
 
         main_layout.addWidget(control_group)
 
+        # Macro Recorder Section
+        recorder_group = QGroupBox("Macro Recorder")
+        recorder_layout = QGridLayout(recorder_group)
+
+        recorder_layout.addWidget(QLabel("Record from:"), 0, 0)
+        self.record_keyboard_combo = QComboBox()
+        recorder_layout.addWidget(self.record_keyboard_combo, 0, 1)
+
+        recorder_layout.addWidget(QLabel("Name:"), 0, 2)
+        self.record_name_line = QLineEdit()
+        self.record_name_line.setPlaceholderText("my_recording")
+        recorder_layout.addWidget(self.record_name_line, 0, 3)
+
+        self.record_btn = QPushButton("Start Recording")
+        self.record_btn.clicked.connect(self.toggle_recording)
+        recorder_layout.addWidget(self.record_btn, 0, 4)
+
+        recorder_layout.setColumnStretch(1, 1)
+        main_layout.addWidget(recorder_group)
+
+        # Capture & Replay Section
+        capture_group = QGroupBox("Capture && Replay")
+        capture_layout = QHBoxLayout(capture_group)
+
+        self.capture_cb = QCheckBox("Capture raw events while monitoring")
+        self.capture_cb.setChecked(self.config_manager.should_capture_events())
+        self.capture_cb.toggled.connect(self.config_manager.set_capture_events)
+        capture_layout.addWidget(self.capture_cb)
+        capture_layout.addStretch()
+
+        capture_layout.addWidget(QLabel("Replay speed (0 = max):"))
+        self.replay_speed_spin = QDoubleSpinBox()
+        self.replay_speed_spin.setRange(0.0, 1000.0)
+        self.replay_speed_spin.setValue(1.0)
+        capture_layout.addWidget(self.replay_speed_spin)
+
+        self.replay_btn = QPushButton("Replay Capture...")
+        self.replay_btn.clicked.connect(self.replay_capture)
+        capture_layout.addWidget(self.replay_btn)
+
+        main_layout.addWidget(capture_group)
+
         # Logs Section using Tabs
         logs_tabs = QTabWidget()
 
@@ -190,6 +302,38 @@ class MainWindow(QMainWindow):
 
         logs_tabs.addTab(system_log_widget, "System Messages")
 
+        # Profiler Tab
+        profiler_widget = QWidget()
+        profiler_layout = QVBoxLayout(profiler_widget)
+        profiler_layout.setContentsMargins(5, 5, 5, 5)
+
+        profiler_controls = QHBoxLayout()
+        self.profiler_cb = QCheckBox("Enable Lua profiler")
+        self.profiler_cb.toggled.connect(self.on_profiler_toggled)
+        profiler_controls.addWidget(self.profiler_cb)
+        profiler_controls.addStretch()
+
+        self.profiler_refresh_btn = QPushButton("Refresh")
+        self.profiler_refresh_btn.clicked.connect(self.refresh_profiler_report)
+        profiler_controls.addWidget(self.profiler_refresh_btn)
+
+        self.profiler_reset_btn = QPushButton("Reset")
+        self.profiler_reset_btn.clicked.connect(self.reset_profiler)
+        profiler_controls.addWidget(self.profiler_reset_btn)
+
+        self.profiler_export_btn = QPushButton("Export Collapsed Stacks...")
+        self.profiler_export_btn.clicked.connect(self.export_profiler_stacks)
+        profiler_controls.addWidget(self.profiler_export_btn)
+
+        profiler_layout.addLayout(profiler_controls)
+
+        self.profiler_report = QTextEdit()
+        self.profiler_report.setReadOnly(True)
+        self.profiler_report.setFont(QFont("Courier", 9))
+        profiler_layout.addWidget(self.profiler_report)
+
+        logs_tabs.addTab(profiler_widget, "Profiler")
+
         main_layout.addWidget(logs_tabs)
 
         # Status Bar
@@ -204,8 +348,16 @@ class MainWindow(QMainWindow):
         status_layout.addWidget(self.status_label)
         status_layout.addStretch()
 
+        self.stats_label = QLabel("")
+        status_layout.addWidget(self.stats_label)
+
         main_layout.addWidget(status_frame)
 
+        # Refresh monitor statistics while monitoring
+        self.stats_timer = QTimer(self)
+        self.stats_timer.setInterval(1000)
+        self.stats_timer.timeout.connect(self.update_stats)
+
     def init_tray(self):
         """Initialize system tray."""
         if not QSystemTrayIcon.isSystemTrayAvailable():
@@ -239,6 +391,13 @@ class MainWindow(QMainWindow):
 
         tray_menu.addSeparator()
 
+        self.profile_menu = tray_menu.addMenu("Profiles")
+        self.profile_action_group = QActionGroup(self)
+        self.profile_action_group.setExclusive(True)
+        self.rebuild_profile_menu()
+
+        tray_menu.addSeparator()
+
         open_scripts_action = QAction("Open Scripts Folder", self)
         open_scripts_action.triggered.connect(self.open_scripts_folder)
         tray_menu.addAction(open_scripts_action)
@@ -256,18 +415,58 @@ class MainWindow(QMainWindow):
 
         self.tray_icon.show()
 
+    def load_profiles(self):
+        """Compile all macro profiles and activate the last used one."""
+        profiles = self.script_manager.profiles
+        for error in profiles.load_all():
+            self.log_system_message(error, "error")
+        if self.script_manager.library.modules:
+            self.log_system_message(f"Loaded Lua library modules: {', '.join(self.script_manager.library.modules)}",
+                                    "info")
+
+        profiles.switch(self.config_manager.get_active_profile())
+        profiles.subscribe(self.profile_switched.emit)
+        self.profile_switched.connect(self.on_profile_switched)
+        self.log_system_message(f"Loaded profiles: {', '.join(profiles.names())} "
+                                f"(active: {profiles.active.name})", "info")
+
+    def rebuild_profile_menu(self):
+        """Fill the tray's profile submenu."""
+        self.profile_menu.clear()
+        for action in self.profile_action_group.actions():
+            self.profile_action_group.removeAction(action)
+
+        profiles = self.script_manager.profiles
+        for name in profiles.names():
+            action = QAction(name, self)
+            action.setCheckable(True)
+            action.setChecked(name == profiles.active.name)
+            action.triggered.connect(lambda checked, profile=name: profiles.switch(profile))
+            self.profile_action_group.addAction(action)
+            self.profile_menu.addAction(action)
+
+    def on_profile_switched(self, name: str):
+        """Reflect a profile switch in the tray menu and remember it."""
+        for action in self.profile_action_group.actions():
+            action.setChecked(action.text() == name)
+        self.config_manager.set_active_profile(name)
+        self.log_system_message(f"Active profile: {name}", "info")
+
     def load_keyboards(self):
         """Load available keyboards into combo box."""
         keyboards = self.keyboard_scanner.find_keyboards()
         self.keyboard_combo.clear()
+        self.record_keyboard_combo.clear()
 
         if not keyboards:
             self.keyboard_combo.addItem("No keyboards found")
+            self.record_keyboard_combo.addItem("No keyboards found")
             self.log_system_message("No keyboards found. Check permissions.", "warning")
             return
 
         for keyboard in keyboards:
             self.keyboard_combo.addItem(f"{keyboard.name} ({keyboard.path})", keyboard)
+            self.record_keyboard_combo.addItem(f"{keyboard.name} ({keyboard.path})", keyboard)
 
         self.log_system_message(f"Found {len(keyboards)} keyboard(s)", "info")
 
@@ -320,50 +519,181 @@ class MainWindow(QMainWindow):
         keyboard = self.keyboard_combo.currentData()
         self.config_manager.set_last_keyboard(keyboard)
 
+        capture_path = None
+        if self.config_manager.should_capture_events():
+            capture_path = self.captures_dir / time.strftime(f"capture-%Y%m%d-%H%M%S{CAPTURE_EXTENSION}")
+
+        self._start_monitor_thread(keyboard.path, keyboard.name, capture_path=capture_path)
+
+    def replay_capture(self):
+        """Run the monitor on a captured event stream instead of a keyboard."""
+        if self.monitor_thread:
+            QMessageBox.warning(self, "Monitoring Active", "Please stop monitoring before replaying a capture.")
+            return
+
+        file_path, _ = QFileDialog.getOpenFileName(
+            self,
+            "Replay Capture",
+            str(self.captures_dir),
+            f"Event captures (*{CAPTURE_EXTENSION});;All Files (*)"
+        )
+        if not file_path:
+            return
+
+        source = ReplayInputSource(Path(file_path), self.replay_speed_spin.value())
+        self._start_monitor_thread(file_path, source.name, input_source=source)
+
+    def _start_monitor_thread(self, device_path: str, name: str, input_source=None, capture_path=None):
+        """Create and start the monitor thread for a keyboard or another input source."""
         # Update script manager timeout
         self.script_manager.timeout = self.config_manager.get_script_timeout()
 
-        self.monitor_thread = KeyboardMonitorThread(keyboard.path, self.script_manager, self.config_manager)
+        if self.config_manager.should_write_journal():
+            self.journal = EventJournal(self.config_dir)
+            self.journal.start()
+
+        self.monitor_thread = KeyboardMonitorThread(device_path, self.script_manager, self.config_manager,
+                                                    self.journal, input_source, capture_path)
         self.monitor_thread.key_pressed.connect(self.on_key_pressed)
         self.monitor_thread.device_disconnected.connect(self.on_device_disconnected)
+        self.monitor_thread.source_finished.connect(self.stop_monitoring)
         self.monitor_thread.log_message.connect(self.log_system_message)
         self.monitor_thread.start()
+        self.stats_timer.start()
 
         self.start_btn.setEnabled(False)
         self.stop_btn.setEnabled(True)
+        self.replay_btn.setEnabled(False)
         self.keyboard_combo.setEnabled(False)
         self.refresh_btn.setEnabled(False)
-        self.status_label.setText(f"Monitoring: {keyboard.name}")
+        self.status_label.setText(f"Monitoring: {name}")
 
-        self.log_system_message(f"Started monitoring: {keyboard.name}", "info")
+        self.log_system_message(f"Started monitoring: {name}", "info")
 
     def stop_monitoring(self):
         """Stop keyboard monitoring."""
+        self.stats_timer.stop()
         if self.monitor_thread:
             self.monitor_thread.stop()
             self.monitor_thread.wait(2000)  # Wait up to 2 seconds
+            self.update_stats()
             self.monitor_thread = None
 
+        if self.journal:
+            self.journal.stop()
+            for error in self.journal.take_errors():
+                self.log_system_message(error, "error")
+            self.journal = None
+
         self.start_btn.setEnabled(True)
         self.stop_btn.setEnabled(False)
+        self.replay_btn.setEnabled(True)
         self.keyboard_combo.setEnabled(True)
         self.refresh_btn.setEnabled(True)
         self.status_label.setText("Monitoring stopped")
 
         self.log_system_message("Monitoring stopped", "info")
 
-    def on_key_pressed(self, keycode: str, filename: str, success: bool, output: str):
+    def toggle_recording(self):
+        """Start or stop recording a macro."""
+        if self.recorder_thread:
+            self.recorder_thread.stop()
+            return
+
+        keyboard = self.record_keyboard_combo.currentData()
+        if keyboard is None:
+            QMessageBox.warning(self, "No Keyboard", "Please select a keyboard to record from.")
+            return
+
+        name = self.record_name_line.text().strip()
+        if not name or not all(c.isalnum() or c in "_-" for c in name):
+            QMessageBox.warning(self, "Invalid Name",
+                                "Please enter a recording name using letters, digits, '_' or '-'.")
+            return
+
+        self.recorder_thread = MacroRecorderThread(keyboard.path, self.recordings_dir, name)
+        self.recorder_thread.recording_finished.connect(self.on_recording_finished)
+        self.recorder_thread.log_message.connect(self.log_system_message)
+        self.recorder_thread.finished.connect(self.on_recorder_stopped)
+        self.recorder_thread.start()
+
+        self.record_btn.setText("Stop Recording")
+        self.record_keyboard_combo.setEnabled(False)
+        self.record_name_line.setEnabled(False)
+        self.log_system_message(f"Recording '{name}' from {keyboard.name}", "info")
+
+    def on_recording_finished(self, name: str, count: int):
+        """Handle a saved recording."""
+        self.log_system_message(f"Saved recording '{name}' ({count} events). "
+                                f"Play it from Lua with play_recording(\"{name}\")", "info")
+
+    def on_recorder_stopped(self):
+        """Reset the recorder controls once the recorder thread has exited."""
+        self.recorder_thread = None
+        self.record_btn.setText("Start Recording")
+        self.record_keyboard_combo.setEnabled(True)
+        self.record_name_line.setEnabled(True)
+
+    def on_key_pressed(self, keycode: str, script_name: str, success: bool, output: str):
         """Handle key press events."""
         status = "SUCCESS" if success else "FAILED"
-        self.key_log.append(f"[{status}] {keycode} -> {filename}.lua")
+        self.key_log.append(f"[{status}] {keycode} -> {script_name}")
 
         if output.strip():
-            self.system_log.append(f"[{filename}] {output}")
+            self.system_log.append(f"[{script_name}] {output}")
 
         # Auto-scroll
         self.key_log.moveCursor(QTextCursor.MoveOperation.End)
         self.system_log.moveCursor(QTextCursor.MoveOperation.End)
 
+    def update_stats(self):
+        """Show the monitor thread's counters in the status bar and log event journal errors."""
+        if not self.monitor_thread:
+            return
+        if self.journal:
+            for error in self.journal.take_errors():
+                self.log_system_message(error, "error")
+        stats = self.monitor_thread.get_stats()
+        debounced = str(stats['debounce_suppressed'])
+        if stats['debounce_top']:
+            # Name the chattering keys, e.g. "Debounced: 12 (space 9, a 3)"
+            debounced += " (" + ", ".join(f"{key} {count}" for key, count in stats['debounce_top']) + ")"
+        self.stats_label.setText(f"Events: {stats['events']} | Dispatched: {stats['dispatched']} | "
+                                 f"Debounced: {debounced} | Forwarded: {stats['forwarded']} | "
+                                 f"Timers: {stats['timers']}")
+
+    def on_profiler_toggled(self, enabled: bool):
+        """Enable or disable the Lua profiler."""
+        self.script_manager.profiler.enabled = enabled
+        self.log_system_message(f"Lua profiler {'enabled' if enabled else 'disabled'}", "info")
+
+    def refresh_profiler_report(self):
+        """Show the current profiler summary and Lua memory usage."""
+        self.profiler_report.setPlainText(
+            f"{self.script_manager.profiler.report()}\n\n{self.script_manager.memory_report()}"
+        )
+
+    def reset_profiler(self):
+        """Discard collected profiler data."""
+        self.script_manager.profiler.reset()
+        self.refresh_profiler_report()
+
+    def export_profiler_stacks(self):
+        """Save the profile as collapsed stacks for flamegraph tools."""
+        file_path, _ = QFileDialog.getSaveFileName(
+            self,
+            "Export Collapsed Stacks",
+            str(self.config_dir / "lua_profile.folded"),
+            "Collapsed stacks (*.folded *.txt);;All Files (*)"
+        )
+        if not file_path:
+            return
+        try:
+            self.script_manager.profiler.write_collapsed(Path(file_path))
+            self.log_system_message(f"Profile exported to {file_path}", "info")
+        except OSError as e:
+            self.log_system_message(f"Could not export profile: {e}", "error")
+
     def on_device_disconnected(self):
         """Handle device disconnection."""
         self.stop_monitoring()
@@ -373,12 +703,17 @@ class MainWindow(QMainWindow):
     def on_timeout_changed(self, value: int):
         """Handle timeout setting change."""
         self.config_manager.set_script_timeout(value)
-        if hasattr(self, 'script_manager'):
-            self.script_manager.timeout = value
+
+    def on_config_changed(self, snapshot, key: str):
+        """Apply configuration changes that affect running components."""
+        if key == "script_timeout":
+            self.script_manager.timeout = snapshot.script_timeout
+        elif key == "lua_memory_limit_mb":
+            self.script_manager.memory_limit_mb = snapshot.lua_memory_limit_mb
 
     def open_scripts_folder(self):
-        """Open the scripts folder in file manager."""
-        subprocess.run(['xdg-open', str(self.keys_dir)])
+        """Open the active profile's scripts folder in file manager."""
+        subprocess.run(['xdg-open', str(self.script_manager.profiles.active.keys_dir)])
 
     def open_config_folder(self):
         """Open the config folder in file manager."""
@@ -423,4 +758,10 @@ class MainWindow(QMainWindow):
     def quit_application(self):
         """Quit the application."""
         self.stop_monitoring()
+        if self.recorder_thread:
+            self.recorder_thread.stop()
+            self.recorder_thread.wait(2000)
+        self.script_manager.macro_player.close()
+        self.script_manager.python_macros.shutdown()
+        self.config_manager.flush()
         QApplication.quit()
\ No newline at end of file
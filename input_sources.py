@@ -0,0 +1,252 @@
+import mmap
+import os
+import struct
+import time
+from pathlib import Path
+from select import select
+from typing import List, Optional
+
+import evdev
+
+# struct input_event of the running kernel: struct timeval, type, code, value
+INPUT_EVENT = struct.Struct("llHHi")
+MAX_EVENTS = 64  # events per read()
+
+
+class EventRecord:
+    """
+    A reusable input event with the attributes of evdev.InputEvent.
+
+    Sources fill the same records on every read(), so reading events allocates
+    no objects. Records are only valid until the next read().
+    """
+
+    __slots__ = ("sec", "usec", "type", "code", "value")
+
+    def __init__(self):
+        self.sec = 0
+        self.usec = 0
+        self.type = 0
+        self.code = 0
+        self.value = 0
+
+
+class EventBatch:
+    """A fixed pool of EventRecords and the list handed out by read()."""
+
+    def __init__(self, size: int = MAX_EVENTS):
+        self.pool = [EventRecord() for _ in range(size)]
+        self.events: List[EventRecord] = []
+
+    def fill(self, index: int, sec: int, usec: int, type_: int, code: int, value: int) -> None:
+        """Set the index-th record and append it to events."""
+        record = self.pool[index]
+        record.sec = sec
+        record.usec = usec
+        record.type = type_
+        record.code = code
+        record.value = value
+        self.events.append(record)
+
+
+class EvdevInputSource:
+    """Reads events from a real input device."""
+
+    def __init__(self, device_path: str):
+        self.device_path = device_path
+        self.device: Optional[evdev.InputDevice] = None
+        self.exhausted = False  # a live device never runs out of events
+        self._batch = EventBatch()
+        self._buffer = bytearray(INPUT_EVENT.size * MAX_EVENTS)
+        self._buffers = [self._buffer]
+
+    @property
+    def name(self) -> str:
+        return self.device.name if self.device else self.device_path
+
+    def open(self) -> None:
+        self.device = evdev.InputDevice(self.device_path)
+
+    def close(self) -> None:
+        if self.device:
+            self.device.close()
+
+    def grab(self) -> None:
+        self.device.grab()
+
+    def ungrab(self) -> None:
+        if self.device:
+            self.device.ungrab()
+
+    def wait(self, timeout: float) -> bool:
+        """Wait up to timeout seconds for events. Returns True if events are ready."""
+        r, w, x = select([self.device], [], [], timeout)
+        return bool(r)
+
+    def read(self) -> List[EventRecord]:
+        """Read up to MAX_EVENTS pending events into the record pool. Raises OSError if the device went away."""
+        batch = self._batch
+        batch.events.clear()
+        try:
+            nbytes = os.readv(self.device.fd, self._buffers)
+        except BlockingIOError:
+            return batch.events
+        unpack_from = INPUT_EVENT.unpack_from
+        size = INPUT_EVENT.size
+        for index in range(nbytes // size):
+            batch.fill(index, *unpack_from(self._buffer, index * size))
+        return batch.events
+
+
+class DiscardingSink:
+    """Passthrough target for replayed events: forwarded keys are counted but never typed."""
+
+    def write_event(self, event) -> None:
+        pass
+
+    def syn(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+# Capture file layout: a 16-byte header followed by fixed 16-byte records, so a
+# capture can be memory-mapped and indexed directly.
+CAPTURE_MAGIC = b"MTKC"
+CAPTURE_VERSION = 1
+CAPTURE_HEADER = struct.Struct("<4sHHQ")  # magic, version, record size, reserved
+CAPTURE_RECORD = struct.Struct("<qHHi")  # timestamp_us, type, code, value
+CAPTURE_EXTENSION = ".mtkc"
+
+
+class CaptureWriter:
+    """Appends the raw event stream of a device to a capture file."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.count = 0
+        self._file = open(path, "wb")
+        self._file.write(CAPTURE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, CAPTURE_RECORD.size, 0))
+
+    def write(self, events) -> None:
+        """Append a batch of events."""
+        pack = CAPTURE_RECORD.pack
+        self._file.write(b"".join(
+            pack(event.sec * 1_000_000 + event.usec, event.type, event.code, event.value) for event in events
+        ))
+        self.count += len(events)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class ReplayInputSource:
+    """
+    Replays a capture file as if it came from a device.
+
+    speed 1.0 reproduces the original timing, N plays N times faster and 0 delivers
+    events as fast as the monitor consumes them. Event timestamps are shifted to start
+    at the current wall clock but keep their original spacing at any speed, so
+    timestamp-based logic such as debouncing behaves exactly as it did live.
+    """
+
+    def __init__(self, path: Path, speed: float = 1.0):
+        self.path = path
+        self.speed = speed
+        self.device = None
+        self._file = None
+        self._mm = None
+        self._count = 0
+        self._index = 0
+        self._t0_us = 0
+        self._start_ns = 0
+        self._wall0_us = 0
+        self._batch = EventBatch()
+
+    @property
+    def name(self) -> str:
+        return f"replay of {self.path.name}"
+
+    @property
+    def exhausted(self) -> bool:
+        return self._index >= self._count
+
+    def open(self) -> None:
+        self._file = open(self.path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, _ = CAPTURE_HEADER.unpack_from(self._mm, 0)
+        if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION or record_size != CAPTURE_RECORD.size:
+            self.close()
+            raise ValueError(f"{self.path.name} is not a MacroTinyKeyB capture")
+
+        self._count = (len(self._mm) - CAPTURE_HEADER.size) // CAPTURE_RECORD.size
+        self._index = 0
+        if self._count:
+            self._t0_us = self._timestamp(0)
+        self._start_ns = time.perf_counter_ns()
+        self._wall0_us = time.time_ns() // 1000
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def grab(self) -> None:
+        pass
+
+    def ungrab(self) -> None:
+        pass
+
+    def _timestamp(self, index: int) -> int:
+        return CAPTURE_RECORD.unpack_from(self._mm, CAPTURE_HEADER.size + index * CAPTURE_RECORD.size)[0]
+
+    def _due_ns(self, timestamp_us: int) -> int:
+        """perf_counter time at which an event recorded at timestamp_us is replayed."""
+        return self._start_ns + int((timestamp_us - self._t0_us) * 1000 / self.speed)
+
+    def wait(self, timeout: float) -> bool:
+        """Sleep until the next event is due or timeout elapses. Returns True if events are ready."""
+        if self.exhausted:
+            return False
+        if not self.speed:
+            return True
+        delay_ns = self._due_ns(self._timestamp(self._index)) - time.perf_counter_ns()
+        if delay_ns <= 0:
+            return True
+        time.sleep(min(delay_ns / 1e9, timeout))
+        return delay_ns <= timeout * 1e9
+
+    def read(self) -> List[EventRecord]:
+        """
+        Return the events that are due, with timestamps shifted to the current wall clock.
+
+        A batch holds at most MAX_EVENTS and ends on an EV_SYN, so frames are never
+        split between reads (unless a single frame is longer than MAX_EVENTS).
+        """
+        batch = self._batch
+        events = batch.events
+        events.clear()
+        now_ns = time.perf_counter_ns()
+        unpack_from = CAPTURE_RECORD.unpack_from
+        syn = evdev.ecodes.EV_SYN
+        frame_end = 0  # number of events up to and including the last EV_SYN
+        while self._index < self._count and len(events) < MAX_EVENTS:
+            timestamp_us, type_, code, value = unpack_from(
+                self._mm, CAPTURE_HEADER.size + self._index * CAPTURE_RECORD.size)
+            if self.speed and self._due_ns(timestamp_us) > now_ns:
+                break
+            wall_us = self._wall0_us + timestamp_us - self._t0_us
+            batch.fill(len(events), wall_us // 1_000_000, wall_us % 1_000_000, type_, code, value)
+            self._index += 1
+            if type_ == syn:
+                frame_end = len(events)
+
+        # A full batch that stopped inside a frame hands the partial frame to the next read
+        if len(events) == MAX_EVENTS and 0 < frame_end < MAX_EVENTS:
+            self._index -= MAX_EVENTS - frame_end
+            del events[frame_end:]
+        return events
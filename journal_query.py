@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Compute per-key latency percentiles from the MacroTinyKeyB event journal.
+
+Usage:
+    python journal_query.py [journal directory] [--key KEY_A] [--errors]
+
+Latency is the time from the kernel event timestamp to the start of the macro,
+duration is the time the macro took to run.
+"""
+
+import argparse
+import json
+import math
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+from event_journal import EventJournal
+
+
+def percentile(sorted_values: Sequence[int], pct: float) -> int:
+    """Nearest-rank percentile of an already sorted sequence."""
+    if not sorted_values:
+        return 0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def load_macro_records(directory: Path) -> List[dict]:
+    """Read all macro records from the journal and its rotated files, oldest first."""
+    records = []
+    for path in EventJournal(directory).files():
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # partially written last line
+                if entry.get("kind") == "macro":
+                    records.append(entry)
+    return records
+
+
+def summarize(records: List[dict]) -> Dict[str, dict]:
+    """Group records by key and compute latency and duration percentiles."""
+    latencies = defaultdict(list)
+    durations = defaultdict(list)
+    errors = defaultdict(int)
+    for entry in records:
+        key = entry["key"]
+        latencies[key].append(entry.get("lat_us", 0))
+        durations[key].append(entry.get("dur_us", 0))
+        if entry.get("status") != "ok":
+            errors[key] += 1
+
+    summary = {}
+    for key in latencies:
+        lat = sorted(latencies[key])
+        dur = sorted(durations[key])
+        summary[key] = {
+            "count": len(lat),
+            "errors": errors[key],
+            "lat_p50": percentile(lat, 50), "lat_p90": percentile(lat, 90),
+            "lat_p99": percentile(lat, 99), "lat_max": lat[-1],
+            "dur_p50": percentile(dur, 50), "dur_p99": percentile(dur, 99),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-key latency percentiles from the event journal")
+    parser.add_argument("directory", nargs="?", type=Path,
+                        default=Path.home() / ".config" / "MacroTinyKeyB",
+                        help="directory containing journal.jsonl")
+    parser.add_argument("--key", help="only show this keycode, e.g. KEY_A")
+    parser.add_argument("--errors", action="store_true", help="only count failed macros")
+    args = parser.parse_args()
+
+    records = load_macro_records(args.directory)
+    if args.key:
+        records = [entry for entry in records if entry["key"] == args.key]
+    if args.errors:
+        records = [entry for entry in records if entry.get("status") != "ok"]
+    if not records:
+        print("No macro records found.")
+        return
+
+    header = f"{'key':<18}{'count':>7}{'errors':>7}{'lat p50':>10}{'p90':>9}{'p99':>9}{'max':>9}" \
+             f"{'dur p50':>10}{'p99':>9}"
+    print(header + "   (microseconds)")
+    print("-" * len(header))
+    for key, stats in sorted(summarize(records).items()):
+        print(f"{key:<18}{stats['count']:>7}{stats['errors']:>7}{stats['lat_p50']:>10}{stats['lat_p90']:>9}"
+              f"{stats['lat_p99']:>9}{stats['lat_max']:>9}{stats['dur_p50']:>10}{stats['dur_p99']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,90 +1,480 @@
+import array
+import gc
+import heapq
 import evdev
-from select import select
+from pathlib import Path
 from PyQt6.QtCore import QThread, pyqtSignal
 from lua_manager import LuaScriptManager
 from key_mapping import KeyMapper
+from event_journal import EventJournal
+from input_sources import CaptureWriter, DiscardingSink, EvdevInputSource
+from realtime import disable_realtime, enable_realtime
+from typing import Dict, List, Optional, Tuple
 import os  # Import os for opening files
+import time
+
+KEY_CNT = evdev.ecodes.KEY_MAX + 1
+RIGHTCTRL = evdev.ecodes.KEY_RIGHTCTRL
+EV_KEY = evdev.ecodes.EV_KEY
+
+
+def _build_name_table() -> list:
+    """Map every keycode number to its KEY_* or BTN_* name (None for unnamed codes)."""
+    table = [None] * KEY_CNT
+    for names in (evdev.ecodes.KEY, evdev.ecodes.BTN):
+        for code, name in names.items():
+            if code < KEY_CNT:
+                table[code] = name[0] if isinstance(name, (list, tuple)) else name
+    return table
+
+
+CODE_NAMES = _build_name_table()
+CODE_FILENAMES = [KeyMapper.keycode_to_filename(name) if name else None for name in CODE_NAMES]
+KEYCODE_FILENAMES = {name: filename for name, filename in zip(CODE_NAMES, CODE_FILENAMES) if name}
+# Script names by key name, so dispatching a press builds no strings
+LUA_SCRIPT_NAMES = {filename: f"{filename}.lua" for filename in KEYCODE_FILENAMES.values()}
+PY_SCRIPT_NAMES = {filename: f"{filename}.py" for filename in KEYCODE_FILENAMES.values()}
+KEY_STATES = ("up", "down", "repeat")  # journal status of an EV_KEY event by its value
 
 
 class KeyboardMonitorThread(QThread):
     """Thread for monitoring keyboard events."""
 
-    key_pressed = pyqtSignal(str, str, bool, str)  # keycode, filename, success, output
+    # Python's automatic GC is paused while monitoring; collections run when idle instead
+    FULL_GC_INTERVAL = 60.0  # seconds between full collections while idle
+    BUSY_GC_OBJECTS = 20000  # young objects after which a batch is followed by a collection anyway
+
+    key_pressed = pyqtSignal(str, str, bool, str)  # keycode, script name, success, output
     device_disconnected = pyqtSignal()
+    source_finished = pyqtSignal()  # a replayed capture reached its end
     log_message = pyqtSignal(str, str)  # message, level (info, warning, error)
 
-    def __init__(self, device_path: str, script_manager: LuaScriptManager, config_manager):
+    def __init__(self, device_path: str, script_manager: LuaScriptManager, config_manager,
+                 journal: Optional[EventJournal] = None, input_source=None, capture_path: Optional[Path] = None):
         super().__init__()
         self.device_path = device_path
         self.script_manager = script_manager
         self.config_manager = config_manager
+        self.journal = journal
+        # Where events come from: the device by default, or e.g. a ReplayInputSource
+        self.source = input_source or EvdevInputSource(device_path)
+        self.capture_path = capture_path
+        self.capture = None
         self.device = None
         self.running = False
         self.pressed_keys = set()  # To keep track of currently pressed keys
+        # Keys whose script has on_release/on_repeat handlers: keycode -> (script set, key name, press time)
+        self._held: Dict[str, Tuple[object, str, int]] = {}
+
+        # Debounce state, indexed by keycode so no allocation happens per event
+        self.debounce_us = config_manager.get_debounce_ms() * 1000
+        self._last_transition_us = array.array('q', [0]) * KEY_CNT  # kernel timestamp of last accepted edge
+        self._key_down = bytearray(KEY_CNT)  # 1 while an accepted key_down has no matching key_up
+        self.suppressed_per_key = array.array('I', [0]) * KEY_CNT
+
+        # Passthrough state: keys without a script are forwarded to a virtual clone of the device
+        self.passthrough = config_manager.snapshot.passthrough_unbound
+        self.uinput = None
+        self._bound = bytearray(KEY_CNT)  # 1 if the keycode has a script
+        self._forwarded = bytearray(KEY_CNT)  # 1 while a forwarded key is held down
+        self._bindings_key = None
+        self._next_full_gc = 0.0
+        self.profile_switch_key = config_manager.snapshot.profile_switch_key
+
+        # Statistics
+        self.events_total = 0
+        self.keys_dispatched = 0
+        self.debounce_suppressed = 0
+        self.keys_forwarded = 0
+        self.timers_fired = 0
+
+        config_manager.subscribe(self._on_config_changed)
+
+    def _on_config_changed(self, snapshot, key: str):
+        """Pick up settings that can change while monitoring."""
+        if key == "debounce_ms":
+            self.debounce_us = snapshot.debounce_ms * 1000
+        elif key == "passthrough_unbound":
+            self.passthrough = snapshot.passthrough_unbound
+        elif key == "profile_switch_key":
+            self.profile_switch_key = snapshot.profile_switch_key
+
+    def get_stats(self) -> dict:
+        """Return monitoring counters."""
+        return {
+            "events": self.events_total,
+            "dispatched": self.keys_dispatched,
+            "debounce_suppressed": self.debounce_suppressed,
+            "debounce_top": self.debounce_top(),
+            "forwarded": self.keys_forwarded,
+            "timers": self.timers_fired,
+        }
+
+    def debounce_top(self, count: int = 3) -> List[Tuple[str, int]]:
+        """The keys with the most suppressed events, as (key name, events) pairs, most first."""
+        suppressed = self.suppressed_per_key
+        codes = heapq.nlargest(count, (code for code in range(KEY_CNT) if suppressed[code]),
+                               key=suppressed.__getitem__)
+        return [(CODE_FILENAMES[code] or str(code), suppressed[code]) for code in codes]
+
+    def _debounce(self, event) -> bool:
+        """
+        Return True if a key event is chatter and should be dropped.
+
+        A key_down is dropped if it follows the last accepted edge of the same key
+        within the debounce window. A key_up is dropped only if its key_down was.
+        """
+        code = event.code
+        if code >= KEY_CNT:
+            return False
+        value = event.value
+
+        if value == 1:
+            now_us = event.sec * 1_000_000 + event.usec
+            if self.debounce_us and now_us - self._last_transition_us[code] < self.debounce_us:
+                self.debounce_suppressed += 1
+                self.suppressed_per_key[code] += 1
+                return True
+            self._last_transition_us[code] = now_us
+            self._key_down[code] = 1
+        elif value == 0:
+            if self.debounce_us and not self._key_down[code]:
+                self.debounce_suppressed += 1
+                self.suppressed_per_key[code] += 1
+                return True
+            self._last_transition_us[code] = event.sec * 1_000_000 + event.usec
+            self._key_down[code] = 0
+        return False
+
+    def _refresh_bindings(self) -> None:
+        """Rebuild the bound-key table when the active profile or its scripts change."""
+        script_set = self.script_manager.profiles.active
+        key = (id(script_set), script_set.version, script_set.bundle.version, self.profile_switch_key)
+        if key == self._bindings_key:
+            return
+        self._bindings_key = key
+
+        names = script_set.bound_names()
+        names.add(self.profile_switch_key)
+        # A chord is bound through its final key; its modifiers are still forwarded
+        for name in [name for name in names if "+" in name]:
+            names.add(name.rsplit("+", 1)[1])
+        for code, filename in enumerate(CODE_FILENAMES):
+            self._bound[code] = filename in names
+
+    def _refresh_scripts(self) -> None:
+        """Pick up library changes and new, deleted and changed scripts of the active profile."""
+        for error in self.script_manager.library.reload_if_changed():
+            self.log_message.emit(error, "error")
+        for error in self.script_manager.profiles.active.refresh():
+            self.log_message.emit(error, "error")
+
+    def _collect_garbage_idle(self) -> None:
+        """Spread Lua and Python garbage collection over quiet periods."""
+        self.script_manager.collect_garbage_step()
+        young, middle, _ = gc.get_count()
+        if time.monotonic() >= self._next_full_gc:
+            gc.collect()
+            self._next_full_gc = time.monotonic() + self.FULL_GC_INTERVAL
+        elif middle >= gc.get_threshold()[1]:
+            gc.collect(1)
+        elif young:
+            gc.collect(0)
+
+    def _run_timers(self) -> None:
+        """Run the Lua timer callbacks that are due. Failing timers are cancelled."""
+        script_manager = self.script_manager
+        for timer in script_manager.timers.advance():
+            start_us = time.time_ns() // 1000
+            start = time.perf_counter_ns()
+            success, output = script_manager.execute_function(timer.callback, timer.owner)
+            self.timers_fired += 1
+            if self.journal is not None:
+                self.journal.record("timer", start_us, "TIMER", f"{timer.owner}#{timer.id}", 0,
+                                    (time.perf_counter_ns() - start) // 1000, "ok" if success else "error", output)
+            if not success:
+                script_manager.timers.cancel(timer.id)
+                self.log_message.emit(f"Timer {timer.id} of {timer.owner} failed and was cancelled: {output}", "error")
+            elif script_manager.lua_output_buffer:
+                self.log_message.emit(f"[timer {timer.id} of {timer.owner}] "
+                                      + "\n".join(script_manager.lua_output_buffer), "info")
+
+    def _open_passthrough(self) -> bool:
+        """
+        Create the virtual clone of the grabbed device used for forwarding.
+
+        Called when monitoring starts and when passthrough is switched on, never from
+        the event path: a new uinput device drops events until the desktop has picked it up.
+        """
+        if self.uinput is None:
+            try:
+                if self.device is None:
+                    # A replayed capture must never type into the live desktop
+                    self.uinput = DiscardingSink()
+                    self.log_message.emit("Passthrough during replay: keys without a script are discarded", "info")
+                    return True
+                name = f"{self.source.name} (MacroTinyKeyB passthrough)"
+                self.uinput = evdev.UInput.from_device(self.device, name=name)
+                self.log_message.emit("Passthrough enabled: keys without a script are forwarded", "info")
+            except (OSError, evdev.UInputError) as e:
+                self.log_message.emit(f"Could not create passthrough device, disabling passthrough: {e}", "warning")
+                self.passthrough = False
+                return False
+        return True
+
+    def _should_forward(self, event) -> bool:
+        """Decide whether a key event goes to the passthrough device instead of a script."""
+        code = event.code
+        if code >= KEY_CNT:
+            return self.passthrough
+        if event.value == 1:
+            # Right Ctrl + key always reaches the script editor shortcut
+            if not self.passthrough or self._bound[code] or (code != RIGHTCTRL and self._key_down[RIGHTCTRL]):
+                return False
+            self._forwarded[code] = 1
+            return True
+        forwarded = self._forwarded[code]
+        if event.value == 0:
+            self._forwarded[code] = 0
+        return bool(forwarded)
 
     def run(self):
         """Main monitoring loop."""
+        realtime = self.config_manager.snapshot.realtime_mode
         try:
-            self.device = evdev.InputDevice(self.device_path)
-            try:
-                self.device.grab()
-                self.log_message.emit("Keyboard successfully grabbed", "info")
-            except OSError:
-                self.log_message.emit("Could not grab keyboard - other programs may still receive events", "warning")
+            if realtime:
+                for message in enable_realtime():
+                    self.log_message.emit(message, "info")
+
+            self.source.open()
+            self.device = self.source.device
+            if self.device is not None:
+                try:
+                    self.source.grab()
+                    self.log_message.emit("Keyboard successfully grabbed", "info")
+                except OSError:
+                    self.log_message.emit("Could not grab keyboard - other programs may still receive events", "warning")
+            else:
+                self.log_message.emit(f"Reading events from {self.source.name}", "info")
+
+            if self.capture_path is not None:
+                self.capture = CaptureWriter(self.capture_path)
+                self.log_message.emit(f"Capturing raw events to {self.capture_path}", "info")
 
             self.running = True
+            self._refresh_bindings()
+            if self.passthrough:
+                self._open_passthrough()
+            gc.disable()
+            self._next_full_gc = time.monotonic() + self.FULL_GC_INTERVAL
 
             while self.running:
-                r, w, x = select([self.device], [], [], 0.1)
-                if r:
-                    try:
-                        events = self.device.read()
-                        for event in events:
-                            if event.type == evdev.ecodes.EV_KEY:
-                                key_event = evdev.categorize(event)
-                                if key_event.keystate == evdev.KeyEvent.key_down:
-                                    self.pressed_keys.add(key_event.keycode)
-                                    self._process_key(key_event.keycode)
-                                elif key_event.keystate == evdev.KeyEvent.key_up:
-                                    self.pressed_keys.discard(key_event.keycode)
-                    except OSError:
-                        self.device_disconnected.emit()
+                # Sleep no longer than the next Lua timer allows
+                ready = self.source.wait(self.script_manager.timers.next_timeout(0.1))
+                self._run_timers()
+                self._refresh_scripts()
+                if self.passthrough:
+                    if self.uinput is None:
+                        self._open_passthrough()  # switched on while monitoring
+                    self._refresh_bindings()
+                if not ready:
+                    if self.source.exhausted:
+                        self.log_message.emit(f"Finished {self.source.name}", "info")
+                        self.source_finished.emit()
                         break
+                    self._collect_garbage_idle()
+                    continue
+                try:
+                    events = self.source.read()
+                    if self.capture is not None:
+                        self.capture.write(events)
+                    forwarded = False
+                    # Hot path: plain attribute and table lookups, no per-event objects
+                    for event in events:
+                        if event.type != EV_KEY:
+                            continue
+                        self.events_total += 1
+                        code = event.code
+                        if self._debounce(event):
+                            if self.journal is not None:
+                                self.journal.record("debounced", event.sec * 1_000_000 + event.usec,
+                                                    CODE_NAMES[code] if code < KEY_CNT else str(code))
+                            continue
+                        # Once the virtual device exists, releases of forwarded keys keep going there
+                        # even if passthrough was switched off in the meantime
+                        if self.uinput is not None and self._should_forward(event):
+                            if self.journal is not None:
+                                self.journal.record("key", event.sec * 1_000_000 + event.usec,
+                                                    CODE_NAMES[code] if code < KEY_CNT else str(code), "passthrough",
+                                                    status=KEY_STATES[event.value] if event.value < 3 else "")
+                            self.uinput.write_event(event)
+                            self.keys_forwarded += 1
+                            forwarded = True
+                            # Forwarded keys still count for chords and the Right Ctrl editor shortcut
+                            if code < KEY_CNT and CODE_NAMES[code] is not None:
+                                if event.value == 1:
+                                    self.pressed_keys.add(CODE_NAMES[code])
+                                elif event.value == 0:
+                                    self.pressed_keys.discard(CODE_NAMES[code])
+                            continue
+                        keycode = CODE_NAMES[code] if code < KEY_CNT else None
+                        if keycode is None:
+                            continue
+                        value = event.value
+                        if self.journal is not None:
+                            self.journal.record("key", event.sec * 1_000_000 + event.usec, keycode,
+                                                status=KEY_STATES[value] if value < 3 else "")
+                        if value == 1:
+                            self.pressed_keys.add(keycode)
+                            self._process_key(keycode, event.sec * 1_000_000 + event.usec)
+                        elif value == 0:
+                            self.pressed_keys.discard(keycode)
+                            if self._held:
+                                self._process_release(keycode, event.sec * 1_000_000 + event.usec)
+                        elif value == 2 and self._held:
+                            self._process_repeat(keycode, event.sec * 1_000_000 + event.usec)
+                    if forwarded:
+                        self.uinput.syn()
+                    if gc.get_count()[0] > self.BUSY_GC_OBJECTS:
+                        gc.collect(0)  # no idle period in sight
+                except OSError:
+                    self.device_disconnected.emit()
+                    break
 
         except Exception as e:
             self.log_message.emit(f"Error in keyboard monitoring: {e}", "error")
+        finally:
+            gc.enable()
+            cancelled = self.script_manager.timers.cancel_all()
+            if cancelled:
+                self.log_message.emit(f"Cancelled {cancelled} pending Lua timer(s)", "info")
+            if self.uinput is not None:
+                self.uinput.close()
+                self.uinput = None
+            if self.capture is not None:
+                self.capture.close()
+                self.log_message.emit(f"Captured {self.capture.count} events to {self.capture_path}", "info")
+                self.capture = None
+            self.source.close()
+            if realtime:
+                disable_realtime()
 
-    def _process_key(self, keycode: str):
-        """Process a single key press."""
+    def _process_key(self, keycode: str, event_us: int = 0):
+        """Process a single key press. event_us is the kernel timestamp of the key_down."""
 
         # If only RCTRL is pressed, do nothing.
         if keycode == 'KEY_RIGHTCTRL' and len(self.pressed_keys) == 1:
             return
 
-        filename = KeyMapper.keycode_to_filename(keycode)
-        script_path = self.script_manager.keys_dir / f"{filename}.lua"
+        filename = KEYCODE_FILENAMES.get(keycode) or KeyMapper.keycode_to_filename(keycode)
+
+        # The designated layer key cycles through the profiles instead of running a script
+        if filename == self.profile_switch_key:
+            self.script_manager.profiles.cycle()  # the main window logs the switch
+            return
+
+        script_set = self.script_manager.profiles.active
+        bundle = script_set.bundle
 
         # Check for rctrl + other key combination
         if 'KEY_RIGHTCTRL' in self.pressed_keys and keycode != 'KEY_RIGHTCTRL':
-            self.log_message.emit(f"Right Control + {filename} pressed. Opening {filename}.lua for editing.", "info")
+            # Keys with a Python macro are edited there, keys that only exist in the bundle in the bundle
+            script_path = script_set.keys_dir / f"{filename}.lua"
+            if filename in script_set.modules or filename in script_set.broken_modules:
+                script_path = script_set.keys_dir / f"{filename}.py"
+            elif not script_path.exists() and bundle.lookup(filename):
+                script_path = bundle.path
+            self.log_message.emit(f"Right Control + {filename} pressed. Opening {script_path.name} for editing.", "info")
 
-            # Get editor path from config manager
-            editor_path = self.config_manager.get_editor_path()
+            # Read the editor path from the lock-free config snapshot
+            editor_path = self.config_manager.snapshot.editor_path
             self.script_manager.open_lua_file_in_editor(script_path, editor_path)
+            if self.journal is not None:
+                self.journal.record("edit", event_us, keycode, filename)
             return  # Do not execute the script, just open the filep
 
-        if not script_path.exists():
-            self.script_manager.create_default_script(filename, script_path)
-            self.log_message.emit(f"Created new script: {filename}.lua", "info")
+        # Precedence: bundle chord entry, Python macro, Lua file, bundle key entry, new template
+        start_us = time.time_ns() // 1000
+        start = time.perf_counter_ns()
+        chord = self._chord_name(keycode, filename)
+        bundle_entry = bundle.lookup(chord) if chord else None
+        if bundle_entry is not None:
+            script_name = f"{bundle.FILENAME}:{chord}"
+            result = script_set.run_bundle_entry(bundle_entry, chord)
+        else:
+            script_name = PY_SCRIPT_NAMES.get(filename) or f"{filename}.py"
+            result = script_set.run_python(filename, event_us)
+            if result is None:
+                script_name = LUA_SCRIPT_NAMES.get(filename) or f"{filename}.lua"
+                result = script_set.run(filename)
+            if result is None:
+                bundle_entry = bundle.lookup(filename)
+                if bundle_entry is not None:
+                    script_name = f"{bundle.FILENAME}:{filename}"
+                    result = script_set.run_bundle_entry(bundle_entry, filename)
+                elif self.passthrough or filename in bundle.chord_keys:
+                    return  # passthrough never creates templates, nor does a chord key pressed on its own
+                else:
+                    script_path = script_set.keys_dir / script_name
+                    self.script_manager.create_default_script(filename, script_path)
+                    self.log_message.emit(f"Created new script: {script_set.label(script_name)}", "info")
+                    result = script_set.run(filename) or (False, f"Could not create {script_path}")
+        if bundle_entry is None and script_name.endswith(".lua") and (script_set.handler(filename, "on_release")
+                                                                      or script_set.handler(filename, "on_repeat")):
+            self._held[keycode] = (script_set, filename, event_us)
+        self._report(keycode, event_us, script_set.label(script_name), start_us, start, result)
+
+    def _process_release(self, keycode: str, event_us: int):
+        """Call the on_release handler of a key pressed with a handler script, passing the hold time."""
+        held = self._held.pop(keycode, None)
+        if held is None:
+            return
+        script_set, filename, press_us = held
+        on_release = script_set.handler(filename, "on_release")
+        if on_release is None:
+            return
+        start_us = time.time_ns() // 1000
+        start = time.perf_counter_ns()
+        result = script_set.run_handler(filename, on_release, (event_us - press_us) / 1000)
+        self._report(keycode, event_us, script_set.label(f"{filename}.lua:on_release"), start_us, start, result)
+
+    def _process_repeat(self, keycode: str, event_us: int):
+        """Call the on_repeat handler of a held key on each auto-repeat event."""
+        held = self._held.get(keycode)
+        if held is None:
+            return
+        script_set, filename, press_us = held
+        on_repeat = script_set.handler(filename, "on_repeat")
+        if on_repeat is None:
+            return
+        start_us = time.time_ns() // 1000
+        start = time.perf_counter_ns()
+        result = script_set.run_handler(filename, on_repeat)
+        self._report(keycode, event_us, script_set.label(f"{filename}.lua:on_repeat"), start_us, start, result)
+
+    def _report(self, keycode: str, event_us: int, script_name: str, start_us: int, start: int,
+                result: Tuple[bool, str]):
+        """Count, journal and emit the result of a script run that started at start (perf_counter_ns)."""
+        success, output = result
+        duration_us = (time.perf_counter_ns() - start) // 1000
+        self.keys_dispatched += 1
+        if self.journal is not None:
+            self.journal.record("macro", event_us, keycode, script_name, start_us - event_us, duration_us,
+                                "ok" if success else "error", output)
+        self.key_pressed.emit(keycode, script_name, success, output)
 
-        success, output = self.script_manager.execute_script(script_path, filename)
-        self.key_pressed.emit(keycode, filename, success, output)
+    def _chord_name(self, keycode: str, filename: str) -> Optional[str]:
+        """Return the chord name ("lctrl+lshift+a") if other keys are held, else None."""
+        if len(self.pressed_keys) < 2:
+            return None
+        modifiers = sorted(KeyMapper.keycode_to_filename(key) for key in self.pressed_keys if key != keycode)
+        return "+".join(modifiers + [filename])
 
     def stop(self):
         """Stop the monitoring thread."""
         self.running = False
-        if self.device:
-            try:
-                self.device.ungrab()
-            except:
-                pass
\ No newline at end of file
+        self.config_manager.unsubscribe(self._on_config_changed)
+        try:
+            self.source.ungrab()
+        except:
+            pass
\ No newline at end of file
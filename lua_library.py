@@ -0,0 +1,87 @@
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+
+class LuaLibrary:
+    """
+    Shared Lua modules in config_dir/lib, available to every script through require().
+
+    All modules are compiled and run once, then kept in package.loaded, so a
+    require() in a macro costs a table lookup. When any module file is added,
+    changed or removed, the whole library is reloaded together and every cached
+    handler table and bundle is dropped, so no script keeps an old module.
+    """
+
+    CHECK_INTERVAL = 0.5  # seconds between checks of the library directory
+
+    def __init__(self, lib_dir: Path, script_manager):
+        self.lib_dir = lib_dir
+        self.script_manager = script_manager
+        self.modules: List[str] = []  # module names currently in package.loaded
+        self.version = 0  # incremented on every reload
+        self._signature = None
+        self._next_check = 0.0
+
+    @staticmethod
+    def module_name(relative_path: Path) -> str:
+        """require() name of a library file: util.lua -> "util", net/http.lua -> "net.http"."""
+        parts = relative_path.with_suffix("").parts
+        if parts[-1] == "init" and len(parts) > 1:
+            parts = parts[:-1]
+        return ".".join(parts)
+
+    def _scan(self) -> Tuple[Tuple[str, int], ...]:
+        """Relative path and mtime of every library file."""
+        if not self.lib_dir.is_dir():
+            return ()
+        files = []
+        for path in self.lib_dir.rglob("*.lua"):
+            try:
+                files.append((path.relative_to(self.lib_dir).as_posix(), path.stat().st_mtime_ns))
+            except OSError:
+                continue  # deleted while scanning; the next check sees the final state
+        return tuple(sorted(files))
+
+    def reload_if_changed(self, force: bool = False) -> List[str]:
+        """Reload all modules if any library file changed. Rate limited unless force is set. Returns errors."""
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return []
+        self._next_check = now + self.CHECK_INTERVAL
+
+        signature = self._scan()
+        if signature == self._signature:
+            return []
+        self._signature = signature
+
+        lua = self.script_manager.lua
+        package = lua.globals().package
+        for name in self.modules:
+            package.loaded[name] = None
+            package.preload[name] = None
+
+        # Register every module first so modules can require each other in any order
+        errors = []
+        names = []
+        for relative, _ in signature:
+            name = self.module_name(Path(relative))
+            path = self.lib_dir / relative
+            try:
+                package.preload[name] = self.script_manager.compile_library_module(path.read_text(),
+                                                                                   f"lib/{relative}")
+                names.append(name)
+            except Exception as e:
+                errors.append(f"Could not compile lib/{relative}: {e}")
+
+        require = lua.globals().require
+        for name in names:
+            try:
+                require(name)
+            except Exception as e:
+                errors.append(f"Could not load library module '{name}': {e}")
+        self.modules = names
+        self.version += 1
+
+        self.script_manager.profiles.invalidate_loaded()
+        return errors
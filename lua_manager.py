@@ -1,28 +1,147 @@
 import subprocess
 from pathlib import Path
-from typing import Tuple
+from typing import Dict, List, Optional, Tuple
 import lupa
 import os
 import sys  # Import sys for platform detection
 from clipboard_utils import get_clipboard_content, set_clipboard_content
+from macro_recorder import MacroPlayer
+from lua_library import LuaLibrary
+from lua_profiler import LuaProfiler
+from profiles import ProfileManager
+from python_macros import PythonMacroRunner
+from timer_wheel import TimerWheel
+
+LuaMemoryError = getattr(lupa, "LuaMemoryError", MemoryError)
 
 
 class LuaScriptManager:
     """Handles creation and execution of Lua scripts."""
 
-    def __init__(self, keys_directory: Path, timeout: int = 5):
+    GC_STEP_KB = 64  # work done by one incremental GC step while the monitor is idle
+    MAX_TIMERS = 10000  # guards against scripts that create timers in a loop
+
+    def __init__(self, keys_directory: Path, timeout: int = 5, recordings_directory: Optional[Path] = None,
+                 memory_limit_mb: int = 0, profiles_directory: Optional[Path] = None,
+                 library_directory: Optional[Path] = None):
         self.keys_dir = keys_directory
         self.timeout = timeout
+        self.macro_player = MacroPlayer(recordings_directory or keys_directory.parent / "recordings")
+        self.macro_player.open()  # so the start of the first playback is not lost; retried on play otherwise
         self.lua_available = self._check_lua_installation()
-        self.lua = lupa.LuaRuntime(unpack_returned_tuples=True)
+        self.lua = self._create_runtime()
         self.lua_output_buffer = []
-        self.lua.execute(f"package.path = package.path .. ';{os.getcwd()}/?.lua'")
-        self.lua.globals().get_clipboard = get_clipboard_content
-        self.lua.globals().set_clipboard = set_clipboard_content
         self.lua.globals().python_print = self._lua_print_redirect
-        self.lua.globals().insert_text = self._lua_insert_text
-        self.lua.globals().run_command = self._lua_run_command
-        self.lua.globals().run_command_async = self._lua_run_command_async
+        # Override Lua's print function to use our Python redirect
+        self.lua.execute("function print(...) python_print(...) end")
+        self.lua.execute('pcall(collectgarbage, "incremental")')
+
+        # Memory limit requests are applied on the thread that runs Lua
+        self.memory_limit_mb = memory_limit_mb
+        self._applied_memory_limit_mb = None
+        self._apply_memory_limit()
+
+        # Each script runs in its own environment; only its `state` table survives between runs
+        self._script_states: Dict[str, object] = {}
+        self.script_memory_kb: Dict[str, float] = {}  # Lua memory allocated by each script's last run
+        self.current_key = ""  # state key of the script that is running
+        self.last_return = None  # value returned by the last function run by execute_function
+
+        # Delayed and periodic callbacks; the monitor thread turns the wheel
+        self.timers = TimerWheel()
+        self._new_env = self.lua.eval(
+            'function(state) return setmetatable({state = state}, {__index = _G}) end'
+        )
+        self._memory_kb = self.lua.eval('function() return collectgarbage("count") end')
+        self._gc_step = self.lua.eval('function(kb) return collectgarbage("step", kb) end')
+        # Each run gets its own function loaded from the chunk's cached bytecode. Rebinding
+        # the shared _ENV upvalue instead would move closures from earlier runs to the new env.
+        self._instantiate = self.lua.eval(
+            'function() local dumps = setmetatable({}, {__mode = "k"}) '
+            'return function(fn, env) local code = dumps[fn] '
+            'if not code then code = string.dump(fn) dumps[fn] = code end '
+            'return load(code, nil, "b", env) end end'
+        )()
+
+        # Python functions exposed to Lua; wrapped with timers while the profiler is enabled
+        self.api_functions = {
+            "get_clipboard": get_clipboard_content,
+            "set_clipboard": set_clipboard_content,
+            "insert_text": self._lua_insert_text,
+            "run_command": self._lua_run_command,
+            "run_command_async": self._lua_run_command_async,
+            "play_recording": self._lua_play_recording,
+            "switch_profile": self._lua_switch_profile,
+            "current_profile": self._lua_current_profile,
+            "set_timeout": self._lua_set_timeout,
+            "set_interval": self._lua_set_interval,
+            "cancel": self._lua_cancel,
+        }
+        self.profiler = LuaProfiler(self.lua)
+        self._profiling_installed = False
+        self._install_api()
+
+        # Compile chunks under a readable name so errors and profiles show "a.lua:3"
+        self._compile = self.lua.eval(
+            'function(code, name, env) local fn, err = load(code, "=" .. name, "t", env) '
+            'if not fn then error(err, 0) end return fn end'
+        )
+
+        # Shared modules for require(): preloaded from config_dir/lib, independent of the launch directory
+        library_directory = library_directory or keys_directory.parent / "lib"
+        package = self.lua.globals().package
+        package.path = ";".join([f"{library_directory}/?.lua", f"{library_directory}/?/init.lua"]
+                                + self._without_relative_entries(package.path))
+        package.cpath = ";".join(self._without_relative_entries(package.cpath))
+        self.library = LuaLibrary(library_directory, self)
+
+        # scripts/<key>.py macros, run outside the Lua runtime
+        self.python_macros = PythonMacroRunner(self)
+
+        # Profiles are compiled by load_all() once the caller can report errors
+        self.profiles = ProfileManager(self.keys_dir, profiles_directory or keys_directory.parent / "profiles", self)
+
+    @staticmethod
+    def _create_runtime() -> lupa.LuaRuntime:
+        """Create the Lua runtime with memory tracking where lupa supports it."""
+        try:
+            return lupa.LuaRuntime(unpack_returned_tuples=True, max_memory=0)
+        except TypeError:
+            # lupa < 2.0 has no memory limits
+            return lupa.LuaRuntime(unpack_returned_tuples=True)
+
+    @staticmethod
+    def _without_relative_entries(search_path: str) -> List[str]:
+        """Drop the "./?.lua"-style entries that make require() depend on the working directory."""
+        return [entry for entry in search_path.split(";") if entry and not entry.startswith("./")]
+
+    def _apply_memory_limit(self) -> None:
+        """Apply the configured memory limit (0 = unlimited) to the runtime."""
+        if self.memory_limit_mb == self._applied_memory_limit_mb:
+            return
+        self._applied_memory_limit_mb = self.memory_limit_mb
+        if hasattr(self.lua, "set_max_memory"):
+            self.lua.set_max_memory(self.memory_limit_mb * 1024 * 1024)
+
+    def collect_garbage_step(self) -> None:
+        """Run one incremental Lua GC step. Called by the monitor thread while idle."""
+        self._gc_step(self.GC_STEP_KB)
+
+    def memory_report(self) -> str:
+        """Return the runtime's memory usage and the allocations of each script's last run."""
+        lines = [f"Lua runtime: {self._memory_kb():.1f} KB in use"
+                 + (f" (limit {self.memory_limit_mb} MB)" if self.memory_limit_mb else "")]
+        for name, kb in sorted(self.script_memory_kb.items(), key=lambda item: -item[1]):
+            lines.append(f"   {name:<20} {kb:>10.1f} KB allocated by last run")
+        return "\n".join(lines)
+
+    def _install_api(self) -> None:
+        """Register the Python API in the Lua globals, timed if the profiler is enabled."""
+        profiling = self.profiler.enabled
+        lua_globals = self.lua.globals()
+        for name, func in self.api_functions.items():
+            lua_globals[name] = self.profiler.wrap_api(name, func) if profiling else func
+        self._profiling_installed = profiling
 
     def _check_lua_installation(self) -> bool:
         """Check if Lua is installed on the system."""
@@ -40,6 +159,10 @@ class LuaScriptManager:
 print("Key {key_name} was pressed!")
 
 -- Insert your macro code here
+-- Globals defined here only live for one key press. To keep values
+-- between presses, store them in the `state` table:
+-- state.count = (state.count or 0) + 1
+
 -- Examples:
 
 -- os.execute("echo 'Hello from {key_name}'")
@@ -67,6 +190,32 @@ print("Key {key_name} was pressed!")
 -- To insert text at cursor position (requires xdotool):
 -- insert_text("This text will be typed at the cursor.")
 
+-- To replay a recorded key sequence (record it in the GUI first):
+-- play_recording("my_recording")        -- original speed
+-- play_recording("my_recording", 2.0)   -- twice as fast
+
+-- To switch to another macro profile (a folder in profiles/):
+-- switch_profile("gaming")
+-- print("Active profile: " .. current_profile())
+
+-- Instead of running top to bottom on every press, a script can return
+-- handlers as its last statement. The file then runs once and each event
+-- calls one function:
+-- return {{
+--     on_press = function() print("down") end,
+--     on_release = function(held_ms) print("held for " .. held_ms .. " ms") end,
+--     on_repeat = function() print("auto-repeat while held") end,
+-- }}
+
+-- Shared helpers go into modules in the lib folder next to scripts
+-- (lib/util.lua returning a table); they are loaded once for all keys:
+-- local util = require("util")
+
+-- To run code later or repeatedly without blocking other keys:
+-- local id = set_interval(function() insert_text("x") end, 500)  -- every 500 ms
+-- set_timeout(function() cancel(id) end, 5000)                   -- once, after 5 s
+-- Keep ids in `state` to cancel a timer from a later key press.
+
 -- To run a shell command and get its output:
 -- local output = run_command("echo Hello from Lua!")
 -- print("Command output: " .. output)
@@ -146,21 +295,111 @@ print("Key {key_name} was pressed!")
         except Exception as e:
             self.lua_output_buffer.append(f"Error launching async command '{command_string}': {e}")
 
-    def execute_script(self, script_path: Path, key_name: str) -> Tuple[bool, str]:
-        """Execute a Lua script and return success status and output."""
+    def _lua_play_recording(self, name: str, speed: float = 1.0) -> int:
+        """
+        Replays a recorded key sequence through a virtual keyboard.
+        Returns the number of events played, or 0 on error.
+        """
+        try:
+            count = self.macro_player.play(name, float(speed or 1.0))
+            self.lua_output_buffer.append(f"Played recording '{name}' ({count} events, speed {speed or 1.0}x)")
+            return count
+        except FileNotFoundError:
+            self.lua_output_buffer.append(f"Error: Recording '{name}' not found.")
+        except Exception as e:
+            self.lua_output_buffer.append(f"Error playing recording '{name}': {e}")
+        return 0
+
+    def _lua_switch_profile(self, name: str) -> bool:
+        """Switches the active macro profile. Returns false if the profile does not exist."""
+        if self.profiles.switch(str(name)):
+            self.lua_output_buffer.append(f"Switched to profile '{name}'")
+            return True
+        self.lua_output_buffer.append(f"Error: Profile '{name}' not found.")
+        return False
+
+    def _lua_current_profile(self) -> str:
+        """Returns the name of the active macro profile."""
+        return self.profiles.active.name
+
+    def _schedule_timer(self, func, delay_ms, interval_ms) -> int:
+        """Schedule a Lua function on the timer wheel for the running script."""
+        if lupa.lua_type(func) != "function":
+            self.lua_output_buffer.append("Error: Timer callback must be a function.")
+            return 0
+        if len(self.timers) >= self.MAX_TIMERS:
+            self.lua_output_buffer.append(f"Error: Too many timers (limit {self.MAX_TIMERS}).")
+            return 0
+        return self.timers.schedule(float(delay_ms or 0), func, float(interval_ms or 0), self.current_key)
+
+    def _lua_set_timeout(self, func, delay_ms=0) -> int:
+        """Runs func once after delay_ms milliseconds. Returns a timer id for cancel()."""
+        return self._schedule_timer(func, delay_ms, 0)
+
+    def _lua_set_interval(self, func, interval_ms) -> int:
+        """Runs func every interval_ms milliseconds until cancelled. Returns a timer id."""
+        return self._schedule_timer(func, interval_ms, interval_ms or TimerWheel.TICK_MS)
+
+    def _lua_cancel(self, timer_id) -> bool:
+        """Cancels a timer. Returns false if it already ran or does not exist."""
+        return self.timers.cancel(int(timer_id or 0))
+
+    def _state_for(self, key_name: str):
+        """Return the persistent `state` table of a script, creating it on first use."""
+        state = self._script_states.get(key_name)
+        if state is None:
+            state = self._script_states[key_name] = self.lua.table()
+        return state
+
+    def compile_chunk(self, code: str, chunk_name: str, key_name: str):
+        """Compile Lua code into a function that runs in a fresh environment for key_name."""
+        return self._compile(code, chunk_name, self._new_env(self._state_for(key_name)))
+
+    def compile_library_module(self, code: str, chunk_name: str):
+        """Compile a library module; it runs in the shared global environment like any require()d module."""
+        return self._compile(code, chunk_name, self.lua.globals())
+
+    def execute_compiled(self, chunk, key_name: str) -> Tuple[bool, str]:
+        """Run a precompiled script chunk in a fresh environment."""
+        try:
+            func = self._instantiate(chunk, self._new_env(self._state_for(key_name)))
+        except Exception as e:
+            return False, f"Error executing script via Lupa: {e}"
+        return self.execute_function(func, key_name)
+
+    def execute_function(self, func, key_name: str, *args) -> Tuple[bool, str]:
+        """Call a compiled Lua function and return success status and output."""
         if not self.lua_available:
             return False, "Lua not installed"
 
         self.lua_output_buffer = []  # Clear buffer before each execution
+        self.current_key = key_name
+        self.last_return = None
 
         try:
-            # Override Lua's print function to use our Python redirect
-            self.lua.execute("function print(...) python_print(...) end")
-            self.lua.execute(script_path.read_text())
+            # Setting changes are applied here, on the thread that runs Lua
+            self._apply_memory_limit()
+            if self.profiler.enabled != self._profiling_installed:
+                self._install_api()
+
+            memory_before = self._memory_kb()
+            if self._profiling_installed:
+                self.profiler.begin(key_name)
+                try:
+                    self.last_return = func(*args)
+                finally:
+                    self.profiler.end()
+            else:
+                self.last_return = func(*args)
+            self.script_memory_kb[key_name] = max(0.0, self._memory_kb() - memory_before)
 
             output = "\n".join(self.lua_output_buffer)
             return True, f"Script executed successfully via Lupa.\nOutput:\n{output}"
 
+        except LuaMemoryError:
+            # Reclaim whatever the failed script left behind before the next event
+            self.lua.execute("collectgarbage()")
+            return False, f"Error executing script via Lupa: memory limit of {self.memory_limit_mb} MB exceeded"
         except Exception as e:
             return False, f"Error executing script via Lupa: {e}"
 
@@ -0,0 +1,176 @@
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable, Dict, List
+
+
+# Lua side of the sampler. A count hook fires every `interval` VM instructions,
+# walks the Lua stack and charges the time since the previous sample to it.
+_SAMPLER_FACTORY = '''
+function(clock, interval)
+    local getinfo, sethook, concat = debug.getinfo, debug.sethook, table.concat
+    local stacks, lines, last, last_key, last_top
+
+    local function hook()
+        local now = clock()
+        local elapsed = now - last
+        last = now
+
+        local frames, n, top = {}, 0, nil
+        local level = 2
+        while true do
+            local info = getinfo(level, "Snl")
+            if not info then break end
+            if info.what ~= "C" then
+                local name = info.name or (info.what == "main" and "main") or "?"
+                n = n + 1
+                frames[n] = name .. " (" .. info.short_src .. ":" .. info.linedefined .. ")"
+                if not top then top = info.short_src .. ":" .. info.currentline end
+            end
+            level = level + 1
+        end
+        if n == 0 then return end
+
+        local ordered = {}
+        for i = n, 1, -1 do ordered[n - i + 1] = frames[i] end
+        local key = concat(ordered, ";")
+        stacks[key] = (stacks[key] or 0) + elapsed
+        lines[top] = (lines[top] or 0) + elapsed
+        last_key, last_top = key, top
+    end
+
+    local sampler = {}
+    function sampler.start()
+        stacks, lines, last, last_key, last_top = {}, {}, clock(), "main", "?"
+        sethook(hook, "", interval)
+    end
+    function sampler.stop()
+        sethook()
+        -- Charge the time since the last sample to the last sampled location
+        local elapsed = clock() - last
+        stacks[last_key] = (stacks[last_key] or 0) + elapsed
+        lines[last_top] = (lines[last_top] or 0) + elapsed
+        return stacks, lines
+    end
+    return sampler
+end
+'''
+
+
+class ScriptProfile:
+    """Aggregated profile of a single script."""
+
+    def __init__(self):
+        self.runs = 0
+        self.total_us = 0
+        self.stacks: Dict[str, int] = defaultdict(int)  # collapsed Lua stack -> microseconds
+        self.lines: Dict[str, int] = defaultdict(int)  # "file:line" -> microseconds
+        self.api_calls: Dict[str, int] = defaultdict(int)
+        self.api_us: Dict[str, int] = defaultdict(int)
+
+
+class LuaProfiler:
+    """
+    Opt-in sampling profiler for Lua macros.
+
+    Lua code is sampled through debug.sethook; calls into the Python API
+    (run_command, clipboard, insert_text, ...) are timed separately and excluded
+    from the Lua samples, so the two never double count.
+    """
+
+    SAMPLE_INTERVAL = 1000  # Lua VM instructions between samples
+
+    def __init__(self, lua):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._profiles: Dict[str, ScriptProfile] = {}
+        self._sampler = lua.eval(_SAMPLER_FACTORY)(self._lua_clock, self.SAMPLE_INTERVAL)
+        self._api_us = 0  # API time spent during the current run
+        self._current = None
+        self._start_us = 0
+
+    @staticmethod
+    def _now_us() -> int:
+        return time.perf_counter_ns() // 1000
+
+    def _lua_clock(self) -> int:
+        """Clock for the Lua sampler that stands still while Python API calls run."""
+        return self._now_us() - self._api_us
+
+    def wrap_api(self, name: str, func: Callable) -> Callable:
+        """Wrap a Python function exposed to Lua so its calls are timed."""
+        def timed(*args):
+            start = self._now_us()
+            try:
+                return func(*args)
+            finally:
+                elapsed = self._now_us() - start
+                self._api_us += elapsed
+                if self._current is not None:
+                    self._current.api_calls[name] += 1
+                    self._current.api_us[name] += elapsed
+        return timed
+
+    def begin(self, script_name: str) -> None:
+        """Start sampling a script run."""
+        with self._lock:
+            self._current = self._profiles.setdefault(script_name, ScriptProfile())
+        self._api_us = 0
+        self._start_us = self._now_us()
+        self._sampler.start()
+
+    def end(self) -> None:
+        """Stop sampling and merge the samples into the script's profile."""
+        stacks, lines = self._sampler.stop()
+        elapsed = self._now_us() - self._start_us
+        with self._lock:
+            profile = self._current
+            profile.runs += 1
+            profile.total_us += elapsed
+            for stack, us in stacks.items():
+                profile.stacks[stack] += int(us)
+            for line, us in lines.items():
+                profile.lines[line] += int(us)
+            self._current = None
+
+    def reset(self) -> None:
+        """Discard all collected data."""
+        with self._lock:
+            self._profiles = {}
+
+    def collapsed_stacks(self) -> List[str]:
+        """Return lines in the collapsed-stack format read by flamegraph tools (weights in microseconds)."""
+        result = []
+        with self._lock:
+            for script, profile in sorted(self._profiles.items()):
+                for stack, us in profile.stacks.items():
+                    if us > 0:
+                        result.append(f"{script};{stack} {us}")
+                for api, us in profile.api_us.items():
+                    if us > 0:
+                        result.append(f"{script};[api] {api} {us}")
+        return result
+
+    def write_collapsed(self, path: Path) -> None:
+        """Write the collapsed stacks to a file."""
+        path.write_text("\n".join(self.collapsed_stacks()) + "\n", encoding="utf-8")
+
+    def report(self, max_lines: int = 10) -> str:
+        """Return a human-readable summary per script."""
+        sections = []
+        with self._lock:
+            for script, profile in sorted(self._profiles.items(), key=lambda item: -item[1].total_us):
+                lua_us = sum(profile.stacks.values())
+                api_us = sum(profile.api_us.values())
+                section = [
+                    f"== {script}: {profile.runs} run(s), total {profile.total_us / 1000:.1f} ms, "
+                    f"Lua {lua_us / 1000:.1f} ms, API {api_us / 1000:.1f} ms"
+                ]
+                for api, us in sorted(profile.api_us.items(), key=lambda item: -item[1]):
+                    section.append(f"   [api] {api:<20} {profile.api_calls[api]:>6} call(s) {us / 1000:>10.1f} ms")
+                hot_lines = sorted(profile.lines.items(), key=lambda item: -item[1])[:max_lines]
+                for line, us in hot_lines:
+                    section.append(f"   {line:<30} {us / 1000:>10.1f} ms")
+                sections.append("\n".join(section))
+        return "\n\n".join(sections) if sections else "No samples collected yet."
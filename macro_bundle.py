@@ -0,0 +1,99 @@
+import time
+from pathlib import Path
+from typing import Dict, FrozenSet, Optional
+
+import lupa
+
+
+class MacroBundle:
+    """
+    Optional single-file macro bundle.
+
+    scripts/macros.lua returns a table keyed by key name ("a", "f1") or chord name
+    ("lctrl+a", modifiers sorted alphabetically) whose values are functions:
+
+        return {
+            a = function() insert_text("Hello") end,
+            ["lctrl+a"] = function() run_command_async("konsole") end,
+        }
+
+    The file is parsed once into an index. Changes are picked up by reload_if_changed(),
+    which swaps in the new index only if the whole file loaded successfully.
+
+    Precedence: a chord entry wins over everything, then a Python macro
+    scripts/<key>.py, then a per-key file scripts/<key>.lua, then the bundle
+    entry for the plain key.
+    """
+
+    FILENAME = "macros.lua"
+    BUNDLE_NAME = "macros"  # key name used for the bundle's own state and profile
+    CHECK_INTERVAL = 0.5  # seconds between checks of the bundle file
+
+    def __init__(self, keys_dir: Path, script_manager, state_key: str = BUNDLE_NAME):
+        self.path = keys_dir / self.FILENAME
+        self.script_manager = script_manager
+        self.state_key = state_key
+        self.index: Dict[str, object] = {}
+        self.chord_keys: FrozenSet[str] = frozenset()  # key names that are part of a chord entry
+        self.version = 0  # incremented whenever the index changes
+        self._mtime_ns = None
+        self._next_check = 0.0
+
+    @staticmethod
+    def normalize_name(name: str) -> str:
+        """Lower-case a key or chord name and sort its modifiers: "A+LShift" -> "lshift+a"."""
+        parts = name.lower().split("+")
+        return "+".join(sorted(parts[:-1]) + parts[-1:])
+
+    def lookup(self, name: str) -> Optional[object]:
+        """Return the Lua function bound to a key or chord name, if any."""
+        return self.index.get(name)
+
+    def reload_if_changed(self, force: bool = False) -> Optional[str]:
+        """
+        Reload the bundle if the file changed. Rate limited unless force is set.
+        Returns an error message if the new bundle could not be loaded.
+        """
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return None
+        self._next_check = now + self.CHECK_INTERVAL
+
+        try:
+            mtime_ns = self.path.stat().st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        if mtime_ns == self._mtime_ns:
+            return None
+        self._mtime_ns = mtime_ns
+
+        if mtime_ns is None:
+            self._swap({})
+            return None
+
+        try:
+            chunk = self.script_manager.compile_chunk(self.path.read_text(), self.FILENAME, self.state_key)
+            table = chunk()
+        except Exception as e:
+            return f"Could not load {self.FILENAME}, keeping previous bundle: {e}"
+
+        if lupa.lua_type(table) != "table":
+            return f"{self.FILENAME} must return a table, keeping previous bundle"
+
+        index = {}
+        for name, value in table.items():
+            if isinstance(name, str) and lupa.lua_type(value) == "function":
+                index[self.normalize_name(name)] = value
+        self._swap(index)
+        return None
+
+    def invalidate(self) -> None:
+        """Make the next reload_if_changed() reload the bundle even if the file did not change."""
+        self._mtime_ns = None
+        self._next_check = 0.0
+
+    def _swap(self, index: Dict[str, object]) -> None:
+        """Replace the index in a single reference assignment."""
+        self.chord_keys = frozenset(part for name in index if "+" in name for part in name.split("+"))
+        self.index = index
+        self.version += 1
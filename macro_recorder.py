@@ -0,0 +1,226 @@
+import array
+import struct
+import sys
+import time
+from pathlib import Path
+from select import select
+from typing import Dict, Optional, Tuple
+
+import evdev
+from PyQt6.QtCore import QThread, pyqtSignal
+
+
+class MacroRecording:
+    """
+    A recorded key sequence.
+
+    Events are stored in a flat unsigned int array as (code, value, delta_us) triples,
+    where delta_us is the time since the previous event in microseconds. On disk the
+    array follows a small little-endian header.
+    """
+
+    MAGIC = b"MTKR"
+    VERSION = 1
+    HEADER = struct.Struct("<4sHI")  # magic, version, event count
+    EXTENSION = ".mrec"
+
+    def __init__(self, data: Optional[array.array] = None):
+        self.data = data if data is not None else array.array("I")
+
+    def __len__(self) -> int:
+        return len(self.data) // 3
+
+    def append(self, code: int, value: int, delta_us: int) -> None:
+        """Append a single key event."""
+        self.data.extend((code, value, delta_us))
+
+    def duration_us(self) -> int:
+        """Total length of the recording in microseconds."""
+        return sum(self.data[2::3])
+
+    def save(self, path: Path) -> None:
+        """Write the recording to disk."""
+        data = self.data
+        if sys.byteorder == "big":
+            data = array.array("I", data)
+            data.byteswap()
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, len(self)))
+            data.tofile(f)
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "MacroRecording":
+        """Read a recording from disk."""
+        with open(path, "rb") as f:
+            magic, version, count = cls.HEADER.unpack(f.read(cls.HEADER.size))
+            if magic != cls.MAGIC or version != cls.VERSION:
+                raise ValueError(f"{path.name} is not a MacroTinyKeyB recording")
+            data = array.array("I")
+            data.fromfile(f, count * 3)
+        if sys.byteorder == "big":
+            data.byteswap()
+        return cls(data)
+
+
+class MacroRecorderThread(QThread):
+    """Thread that records key events from a keyboard without grabbing it."""
+
+    recording_finished = pyqtSignal(str, int)  # name, event count
+    log_message = pyqtSignal(str, str)  # message, level (info, warning, error)
+
+    def __init__(self, device_path: str, recordings_dir: Path, name: str):
+        super().__init__()
+        self.device_path = device_path
+        self.recordings_dir = recordings_dir
+        self.name = name
+        self.running = False
+
+    def run(self):
+        """Record until stop() is called, then save the recording."""
+        recording = MacroRecording()
+        last_us = None
+
+        try:
+            device = evdev.InputDevice(self.device_path)
+        except OSError as e:
+            self.log_message.emit(f"Could not open {self.device_path} for recording: {e}", "error")
+            return
+
+        self.running = True
+        try:
+            while self.running:
+                r, w, x = select([device], [], [], 0.1)
+                if not r:
+                    continue
+                for event in device.read():
+                    if event.type != evdev.ecodes.EV_KEY:
+                        continue
+                    now_us = event.sec * 1_000_000 + event.usec
+                    delta_us = 0 if last_us is None else max(0, now_us - last_us)
+                    last_us = now_us
+                    recording.append(event.code, event.value, delta_us)
+        except OSError:
+            self.log_message.emit("Recording device disconnected", "warning")
+        finally:
+            device.close()
+
+        path = self.recordings_dir / f"{self.name}{MacroRecording.EXTENSION}"
+        try:
+            recording.save(path)
+        except OSError as e:
+            self.log_message.emit(f"Could not save recording {path}: {e}", "error")
+            return
+        self.recording_finished.emit(self.name, len(recording))
+
+    def stop(self):
+        """Stop recording."""
+        self.running = False
+
+
+class MacroPlayer:
+    """Replays recordings through a virtual uinput keyboard with sub-millisecond timing."""
+
+    SPIN_THRESHOLD_NS = 1_000_000  # sleep until this close to the deadline, then busy-wait
+    BATCH_WINDOW_NS = 200_000  # events due within this window are written before one SYN
+    SETTLE_TIME = 0.2  # seconds a new virtual keyboard needs before the desktop sees its events
+
+    def __init__(self, recordings_dir: Path):
+        self.recordings_dir = recordings_dir
+        self._cache: Dict[str, Tuple[int, MacroRecording]] = {}
+        self._uinput = None
+        self._ready_at = 0.0
+
+    def open(self) -> bool:
+        """Create the virtual keyboard ahead of the first playback. Returns False if uinput is unavailable."""
+        try:
+            self._get_uinput()
+            return True
+        except (OSError, evdev.UInputError):
+            return False
+
+    def load(self, name: str) -> MacroRecording:
+        """Load a recording by name, reusing the cached copy while the file is unchanged."""
+        path = self.recordings_dir / f"{name}{MacroRecording.EXTENSION}"
+        mtime_ns = path.stat().st_mtime_ns
+        cached = self._cache.get(name)
+        if cached and cached[0] == mtime_ns:
+            return cached[1]
+
+        recording = MacroRecording.load(path)
+        self._cache[name] = (mtime_ns, recording)
+        return recording
+
+    def _get_uinput(self) -> evdev.UInput:
+        """Return the virtual keyboard, creating it if needed and waiting until it is picked up."""
+        if self._uinput is None:
+            self._uinput = evdev.UInput(name="MacroTinyKeyB player")
+            self._ready_at = time.monotonic() + self.SETTLE_TIME
+        remaining = self._ready_at - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        return self._uinput
+
+    @classmethod
+    def _wait_until(cls, deadline_ns: int) -> None:
+        """Sleep coarsely, then spin for the final stretch to hit the deadline precisely."""
+        remaining = deadline_ns - time.perf_counter_ns()
+        if remaining > cls.SPIN_THRESHOLD_NS:
+            time.sleep((remaining - cls.SPIN_THRESHOLD_NS) / 1e9)
+        while time.perf_counter_ns() < deadline_ns:
+            pass
+
+    def play(self, name: str, speed: float = 1.0) -> int:
+        """Play a recording and return the number of events written."""
+        if speed <= 0:
+            raise ValueError("speed must be greater than zero")
+
+        recording = self.load(name)
+        ui = self._get_uinput()
+        data = recording.data
+        count = len(recording)
+        scale = 1000.0 / speed  # microseconds -> scaled nanoseconds
+        ev_key = evdev.ecodes.EV_KEY
+        held = set()
+
+        start_ns = time.perf_counter_ns()
+        due_us = 0
+        i = 0
+        try:
+            while i < count:
+                due_us += data[i * 3 + 2]
+                deadline = start_ns + int(due_us * scale)
+                self._wait_until(deadline)
+
+                # Write every event that falls into this batch window, then a single SYN
+                while True:
+                    code, value = data[i * 3], data[i * 3 + 1]
+                    ui.write(ev_key, code, value)
+                    if value:
+                        held.add(code)
+                    else:
+                        held.discard(code)
+                    i += 1
+                    # Keep a press and release of the same key in separate frames
+                    if i >= count or data[i * 3] == code:
+                        break
+                    next_due_us = due_us + data[i * 3 + 2]
+                    if start_ns + int(next_due_us * scale) - deadline > self.BATCH_WINDOW_NS:
+                        break
+                    due_us = next_due_us
+                ui.syn()
+        finally:
+            # Never leave keys pressed if a recording ended mid-press or playback failed
+            for code in held:
+                ui.write(ev_key, code, 0)
+            if held:
+                ui.syn()
+
+        return count
+
+    def close(self) -> None:
+        """Release the virtual keyboard."""
+        if self._uinput is not None:
+            self._uinput.close()
+            self._uinput = None
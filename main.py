@@ -18,6 +18,7 @@ Author: Enhanced with PyQt6 GUI and Single Instance
 License: MIT
 """
 
+import gc
 import sys
 import subprocess
 import os
@@ -117,6 +118,11 @@ def main():
     
     window = MainWindow()
     window.show()
+
+    # Startup objects live for the whole session: move them out of the collector's
+    # view so later collections only walk objects created while running
+    gc.collect()
+    gc.freeze()
     
     sys.exit(app.exec())
 
@@ -0,0 +1,297 @@
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import lupa
+
+from macro_bundle import MacroBundle
+
+
+class ScriptSet:
+    """
+    The compiled scripts of one profile: every scripts/<key>.lua plus the optional bundle.
+
+    Files are compiled when the profile is loaded. On each press get() only stats the
+    file and recompiles it if it changed; refresh() picks up added and removed files.
+
+    A script either runs top to bottom on every press, or returns a table of
+    handlers (on_press, on_release, on_repeat). The first press runs the file to
+    find out; handler tables are cached until the file changes.
+
+    scripts/<key>.py modules with an on_press(ctx) function take precedence over
+    the Lua file of the same key and are reloaded the same way.
+    """
+
+    REFRESH_INTERVAL = 0.5  # seconds between scans of the profile directory
+    HANDLER_NAMES = ("on_press", "on_release", "on_repeat")
+
+    def __init__(self, name: str, keys_dir: Path, script_manager, is_default: bool = False):
+        self.name = name
+        self.keys_dir = keys_dir
+        self.script_manager = script_manager
+        self.is_default = is_default
+        self.bundle = MacroBundle(keys_dir, script_manager, self.state_key(MacroBundle.BUNDLE_NAME))
+        self.chunks: Dict[str, Tuple[int, object]] = {}  # key name -> (mtime_ns, compiled chunk)
+        self.handlers: Dict[str, Optional[Dict[str, object]]] = {}  # key name -> handlers, None = whole-file script
+        self.modules: Dict[str, Tuple[int, object]] = {}  # key name -> (mtime_ns, Python macro module)
+        self.broken_modules: Dict[str, Tuple[int, str]] = {}  # key name -> (mtime_ns, error) of .py files that fail
+        self.version = 0  # incremented whenever the set of bound key names changes
+        self._labels: Dict[str, str] = {}
+        self._dir_mtime_ns = None
+        self._next_refresh = 0.0
+
+    def state_key(self, key_name: str) -> str:
+        """Name under which a script's state and statistics are kept."""
+        return key_name if self.is_default else f"{self.name}/{key_name}"
+
+    def label(self, script_name: str) -> str:
+        """Display name of a script in this profile."""
+        if self.is_default:
+            return script_name
+        label = self._labels.get(script_name)
+        if label is None:
+            label = self._labels[script_name] = f"{self.name}/{script_name}"
+        return label
+
+    def bound_names(self) -> Set[str]:
+        """Key and chord names that have a script in this profile."""
+        return set(self.chunks) | set(self.modules) | set(self.broken_modules) | set(self.bundle.index)
+
+    def load(self) -> List[str]:
+        """Compile every script and the bundle. Returns error messages."""
+        errors = self._scan()
+        error = self.bundle.reload_if_changed(force=True)
+        if error:
+            errors.append(self.label(error))
+        return errors
+
+    def refresh(self) -> List[str]:
+        """Pick up added or removed files and bundle changes (rate limited). Returns error messages."""
+        errors = []
+        now = time.monotonic()
+        if now >= self._next_refresh:
+            self._next_refresh = now + self.REFRESH_INTERVAL
+            errors = self._scan()
+        error = self.bundle.reload_if_changed()
+        if error:
+            errors.append(self.label(error))
+        return errors
+
+    def _scan(self) -> List[str]:
+        """Compile new scripts and forget deleted ones if the directory changed."""
+        try:
+            mtime_ns = self.keys_dir.stat().st_mtime_ns
+        except OSError:
+            return []
+        if mtime_ns == self._dir_mtime_ns:
+            return []
+        self._dir_mtime_ns = mtime_ns
+
+        errors = []
+        names = {path.stem for path in self.keys_dir.glob("*.lua") if path.name != MacroBundle.FILENAME}
+        for name in names - set(self.chunks):
+            try:
+                self.get(name)
+            except Exception as e:
+                errors.append(f"Could not compile {self.label(name + '.lua')}: {e}")
+        for name in set(self.chunks) - names:
+            del self.chunks[name]
+            self.handlers.pop(name, None)
+            self.version += 1
+
+        modules = {path.stem for path in self.keys_dir.glob("*.py")}
+        for name in modules - set(self.modules) - set(self.broken_modules):
+            try:
+                self.get_module(name)
+            except Exception as e:
+                errors.append(f"Could not load {self.label(name + '.py')}: {e}")
+        for name in (set(self.modules) | set(self.broken_modules)) - modules:
+            self.modules.pop(name, None)
+            self.broken_modules.pop(name, None)
+            self.version += 1
+        return errors
+
+    def get(self, key_name: str) -> Optional[object]:
+        """Return the compiled chunk for a key, recompiling it if the file changed; None if there is no file."""
+        path = self.keys_dir / f"{key_name}.lua"
+        try:
+            mtime_ns = path.stat().st_mtime_ns
+        except OSError:
+            self.handlers.pop(key_name, None)
+            if self.chunks.pop(key_name, None) is not None:
+                self.version += 1
+            return None
+
+        cached = self.chunks.get(key_name)
+        if cached is not None and cached[0] == mtime_ns:
+            return cached[1]
+
+        chunk = self.script_manager.compile_chunk(path.read_text(), path.name, self.state_key(key_name))
+        self.chunks[key_name] = (mtime_ns, chunk)
+        self.handlers.pop(key_name, None)  # found out again on the next press
+        if cached is None:
+            self.version += 1
+        return chunk
+
+    def get_module(self, key_name: str) -> Optional[object]:
+        """Return the Python macro module of a key, reloading it if the file changed; None if there is none."""
+        path = self.keys_dir / f"{key_name}.py"
+        try:
+            mtime_ns = path.stat().st_mtime_ns
+        except OSError:
+            removed = self.modules.pop(key_name, None) is not None
+            if self.broken_modules.pop(key_name, None) is not None or removed:
+                self.version += 1
+            return None
+
+        cached = self.modules.get(key_name)
+        if cached is not None and cached[0] == mtime_ns:
+            return cached[1]
+        broken = self.broken_modules.get(key_name)
+        if broken is not None and broken[0] == mtime_ns:
+            raise ImportError(broken[1])  # unchanged since it failed; do not import it again
+
+        module_name = "mtkb_macros." + self.state_key(key_name).replace("/", ".")
+        try:
+            module = self.script_manager.python_macros.load(path, module_name)
+        except Exception as e:
+            # Still bound, so presses report the error instead of falling through to the Lua file
+            self.broken_modules[key_name] = (mtime_ns, str(e))
+            if cached is None and broken is None:
+                self.version += 1
+            raise
+        self.modules[key_name] = (mtime_ns, module)
+        self.broken_modules.pop(key_name, None)
+        if cached is None and broken is None:
+            self.version += 1
+        return module
+
+    def run_python(self, key_name: str, event_us: int = 0) -> Optional[Tuple[bool, str]]:
+        """Run the on_press of a key's Python macro. Returns None if the key has no Python macro."""
+        if key_name not in self.modules and key_name not in self.broken_modules:
+            return None  # new files are found by refresh(), so Lua-only keys cost no extra stat
+        try:
+            module = self.get_module(key_name)
+        except Exception as e:
+            return False, f"Error loading Python macro: {e}"
+        if module is None:
+            return None
+        return self.script_manager.python_macros.run(module, key_name, self.state_key(key_name), self.name, event_us)
+
+    def run(self, key_name: str) -> Optional[Tuple[bool, str]]:
+        """Handle a press of a key with a script file. Returns None if the key has no script file."""
+        try:
+            chunk = self.get(key_name)
+        except Exception as e:
+            return False, f"Error executing script via Lupa: {e}"
+        if chunk is None:
+            return None
+
+        if key_name in self.handlers:
+            handlers = self.handlers[key_name]
+            if handlers is None:
+                return self.script_manager.execute_compiled(chunk, self.state_key(key_name))
+        else:
+            success, output = self.script_manager.execute_compiled(chunk, self.state_key(key_name))
+            if not success:
+                return success, output
+            handlers = self._handler_table(self.script_manager.last_return)
+            self.handlers[key_name] = handlers
+            if handlers is None:
+                return success, output  # a whole-file script: this run was the press
+
+        on_press = handlers.get("on_press")
+        if on_press is None:
+            return True, ""
+        return self.run_handler(key_name, on_press)
+
+    def _handler_table(self, value) -> Optional[Dict[str, object]]:
+        """Extract the handler functions from a script's return value, None if it has none."""
+        if lupa.lua_type(value) != "table":
+            return None
+        handlers = {name: value[name] for name in self.HANDLER_NAMES if lupa.lua_type(value[name]) == "function"}
+        return handlers or None
+
+    def handler(self, key_name: str, event: str) -> Optional[object]:
+        """Return a key's cached on_release/on_repeat handler, if it has one."""
+        handlers = self.handlers.get(key_name)
+        return handlers.get(event) if handlers else None
+
+    def run_handler(self, key_name: str, func, *args) -> Tuple[bool, str]:
+        """Call one of a key's handler functions."""
+        return self.script_manager.execute_function(func, self.state_key(key_name), *args)
+
+    def run_bundle_entry(self, func, name: str) -> Tuple[bool, str]:
+        """Run a function from this profile's bundle."""
+        return self.script_manager.execute_function(func, self.state_key(name))
+
+
+class ProfileManager:
+    """
+    Named profiles, all compiled up front.
+
+    The default profile is the scripts directory; every sub-directory of the
+    profiles directory is another profile. Switching only replaces the `active`
+    reference, so it costs no disk I/O or compilation.
+    """
+
+    DEFAULT = "default"
+
+    def __init__(self, keys_dir: Path, profiles_dir: Path, script_manager):
+        self.keys_dir = keys_dir
+        self.profiles_dir = profiles_dir
+        self.script_manager = script_manager
+        self.sets: Dict[str, ScriptSet] = {
+            self.DEFAULT: ScriptSet(self.DEFAULT, keys_dir, script_manager, is_default=True)
+        }
+        self.active = self.sets[self.DEFAULT]
+        self._listeners: List[Callable[[str], None]] = []
+
+    def load_all(self) -> List[str]:
+        """Load the Lua library, then discover and compile every profile. Returns error messages."""
+        library_errors = self.script_manager.library.reload_if_changed(force=True)
+        sets = {self.DEFAULT: self.sets[self.DEFAULT]}
+        if self.profiles_dir.is_dir():
+            for path in sorted(self.profiles_dir.iterdir()):
+                if path.is_dir() and path.name != self.DEFAULT:
+                    sets[path.name] = self.sets.get(path.name) or ScriptSet(path.name, path, self.script_manager)
+
+        errors = library_errors
+        for script_set in sets.values():
+            errors.extend(script_set.load())
+        self.sets = sets
+        if self.active.name not in sets:
+            self.active = sets[self.DEFAULT]
+        return errors
+
+    def invalidate_loaded(self) -> None:
+        """Forget every cached handler table and bundle, e.g. after the Lua library changed."""
+        for script_set in self.sets.values():
+            script_set.handlers.clear()
+            script_set.bundle.invalidate()
+
+    def names(self) -> List[str]:
+        """Names of all loaded profiles, default first."""
+        return list(self.sets)
+
+    def subscribe(self, listener: Callable[[str], None]) -> None:
+        """Register a callback invoked with the profile name after every switch."""
+        self._listeners.append(listener)
+
+    def switch(self, name: str) -> bool:
+        """Make a loaded profile active. Returns False if there is no such profile."""
+        script_set = self.sets.get(name)
+        if script_set is None:
+            return False
+        if script_set is not self.active:
+            self.active = script_set
+            for listener in list(self._listeners):
+                listener(name)
+        return True
+
+    def cycle(self) -> str:
+        """Switch to the next profile and return its name."""
+        names = self.names()
+        name = names[(names.index(self.active.name) + 1) % len(names)]
+        self.switch(name)
+        return name
@@ -0,0 +1,153 @@
+import importlib.util
+import queue
+import subprocess
+import threading
+import time
+import traceback
+from concurrent.futures import Future, TimeoutError
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from clipboard_utils import get_clipboard_content, set_clipboard_content
+
+
+class MacroContext:
+    """The `ctx` argument of a Python macro's on_press(ctx)."""
+
+    def __init__(self, runner: "PythonMacroRunner", key: str, profile: str, state: dict, event_us: int):
+        self._runner = runner
+        self.key = key  # key name, e.g. "a"
+        self.profile = profile
+        self.state = state  # dict kept between presses of this key
+        self.event_us = event_us  # kernel timestamp of the key press
+        self.output = []
+
+    def print(self, *args) -> None:
+        """Add a line to the macro's output shown in the system log."""
+        self.output.append(" ".join(str(arg) for arg in args))
+
+    def get_clipboard(self) -> str:
+        return get_clipboard_content()
+
+    def set_clipboard(self, text: str) -> None:
+        set_clipboard_content(text)
+
+    def insert_text(self, text: str, delay_ms: int = 100) -> None:
+        """Paste text at the cursor through the clipboard, then restore the clipboard. Requires xdotool."""
+        original_clipboard = get_clipboard_content()
+        set_clipboard_content(text)
+        time.sleep(delay_ms / 1000.0)
+        try:
+            subprocess.run(['xdotool', 'key', 'control+v'], check=True)
+        finally:
+            time.sleep(0.05)
+            set_clipboard_content(original_clipboard)
+
+    def run_command(self, command_string: str) -> str:
+        """Run a shell command and return its stdout. Raises on failure or timeout."""
+        result = subprocess.run(command_string, shell=True, capture_output=True, text=True, check=True,
+                                timeout=self._runner.script_manager.timeout)
+        return result.stdout.strip()
+
+    def run_command_async(self, command_string: str) -> None:
+        subprocess.Popen(command_string, shell=True)
+
+    def play_recording(self, name: str, speed: float = 1.0) -> int:
+        return self._runner.script_manager.macro_player.play(name, float(speed or 1.0))
+
+    def switch_profile(self, name: str) -> bool:
+        return self._runner.script_manager.profiles.switch(str(name))
+
+
+class PythonMacroRunner:
+    """
+    Loads scripts/<key>.py modules and runs their on_press(ctx) on a worker pool.
+
+    Modules are imported without going through sys.modules, so reloading a
+    changed file simply replaces the cached module object. The monitor waits for
+    a handler at most the script timeout; a handler that runs longer is reported
+    as failed and keeps its worker until it returns. Workers are daemon threads,
+    so a handler that never returns does not keep the application from quitting,
+    and a press is refused with an error while every worker is stuck.
+    """
+
+    MAX_WORKERS = 4
+
+    def __init__(self, script_manager):
+        self.script_manager = script_manager
+        self._jobs = queue.SimpleQueue()
+        self._workers: List[threading.Thread] = []  # started on demand, up to MAX_WORKERS
+        self._busy = 0  # workers running or about to run a handler
+        self._lock = threading.Lock()
+        self._closed = False
+        self._states: Dict[str, dict] = {}
+
+    def _worker_loop(self) -> None:
+        """Run queued handlers until shutdown() queues None."""
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            future, func, ctx = job
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(func(ctx))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._busy -= 1
+
+    def _submit(self, func, ctx) -> Optional[Future]:
+        """Hand a handler to a free worker. Returns None if every worker is still busy or after shutdown()."""
+        with self._lock:
+            if self._closed or self._busy >= self.MAX_WORKERS:
+                return None
+            self._busy += 1
+            if len(self._workers) < self._busy:
+                worker = threading.Thread(target=self._worker_loop, daemon=True,
+                                          name=f"PythonMacro_{len(self._workers)}")
+                worker.start()
+                self._workers.append(worker)
+        future = Future()
+        self._jobs.put((future, func, ctx))
+        return future
+
+    @staticmethod
+    def load(path: Path, module_name: str):
+        """Import a macro module from its file. Raises if it fails or has no on_press."""
+        spec = importlib.util.spec_from_file_location(module_name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        if not callable(getattr(module, "on_press", None)):
+            raise AttributeError(f"{path.name} does not define on_press(ctx)")
+        return module
+
+    def run(self, module, key_name: str, state_key: str, profile: str, event_us: int) -> Tuple[bool, str]:
+        """Call module.on_press(ctx) on a worker and return success status and output."""
+        state = self._states.get(state_key)
+        if state is None:
+            state = self._states[state_key] = {}
+        ctx = MacroContext(self, key_name, profile, state, event_us)
+
+        future = self._submit(module.on_press, ctx)
+        if future is None:
+            return False, (f"Python macro not started: all {self.MAX_WORKERS} workers are still running "
+                           "handlers that timed out.")
+        try:
+            future.result(timeout=self.script_manager.timeout)
+        except TimeoutError:
+            return False, f"Python macro timed out after {self.script_manager.timeout} seconds."
+        except Exception as e:
+            ctx.output.append("".join(traceback.format_exception_only(type(e), e)).strip())
+            return False, "Error executing Python macro.\nOutput:\n" + "\n".join(ctx.output)
+        return True, "Python macro executed successfully.\nOutput:\n" + "\n".join(ctx.output)
+
+    def shutdown(self) -> None:
+        """Let idle workers exit; running handlers are not waited for."""
+        with self._lock:
+            workers, self._workers = self._workers, []
+            self._closed = True
+        for _ in workers:
+            self._jobs.put(None)
@@ -0,0 +1,78 @@
+import ctypes
+import ctypes.util
+import os
+import resource
+import threading
+from typing import List
+
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+RT_PRIORITY = 10  # above every normal thread, below audio servers and kernel IRQ threads (50)
+NICE_FALLBACK = -10
+
+
+def _libc():
+    return ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+
+
+def enable_realtime() -> List[str]:
+    """
+    Give the calling thread low-latency scheduling. Returns log lines describing what it got.
+
+    Tries SCHED_FIFO, then SCHED_RR, then a negative nice value. The thread is pinned
+    to the last CPU it may run on (CPU 0 usually handles the most interrupts) and
+    the process memory is locked so the hot path does not wait for page-ins. Every
+    step that is not permitted is skipped.
+    """
+    messages = []
+    if not hasattr(os, "sched_setscheduler"):
+        return ["Realtime mode is not supported on this platform"]
+
+    policy = None
+    for name in ("SCHED_FIFO", "SCHED_RR"):
+        try:
+            os.sched_setscheduler(0, getattr(os, name), os.sched_param(RT_PRIORITY))
+            policy = f"{name} priority {RT_PRIORITY}"
+            break
+        except (OSError, AttributeError):
+            continue
+    if policy is None:
+        try:
+            # On Linux the nice value of a thread is set through its thread id
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), NICE_FALLBACK)
+            policy = f"SCHED_OTHER nice {NICE_FALLBACK} (no permission for realtime priority)"
+        except OSError:
+            policy = "SCHED_OTHER (no permission for realtime priority or negative nice)"
+    messages.append(f"Realtime mode: monitor thread runs under {policy}")
+
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+        if len(cpus) > 1:
+            os.sched_setaffinity(0, {cpus[-1]})
+            messages.append(f"Realtime mode: monitor thread pinned to CPU {cpus[-1]}")
+    except OSError as e:
+        messages.append(f"Realtime mode: could not set CPU affinity: {e}")
+
+    # With a finite memlock limit MCL_FUTURE would make later allocations fail, so
+    # only the pages mapped so far are locked then
+    flags = MCL_CURRENT
+    if resource.getrlimit(resource.RLIMIT_MEMLOCK)[0] == resource.RLIM_INFINITY:
+        flags |= MCL_FUTURE
+    try:
+        if _libc().mlockall(flags) != 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        messages.append("Realtime mode: process memory locked")
+    except OSError as e:
+        messages.append(f"Realtime mode: could not lock memory ({e.strerror or e}); "
+                        "raise the memlock limit to enable it")
+    return messages
+
+
+def disable_realtime() -> None:
+    """Unlock the process memory again. Scheduling settings end with the monitor thread."""
+    try:
+        _libc().munlockall()
+    except OSError:
+        pass
+
@@ -0,0 +1,7 @@
+import os
+import sys
+from pathlib import Path
+
+# The application modules live at the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
@@ -0,0 +1,140 @@
+import time
+import tracemalloc
+from dataclasses import replace
+from pathlib import Path
+
+import evdev
+
+from config import ConfigSnapshot
+from event_journal import EventJournal
+from input_sources import CAPTURE_HEADER, CAPTURE_MAGIC, CAPTURE_RECORD, CAPTURE_VERSION, ReplayInputSource
+from keyboard_monitor import KeyboardMonitorThread
+from lua_manager import LuaScriptManager
+
+E = evdev.ecodes
+REPO = Path(__file__).resolve().parent.parent
+UNBOUND_KEYS = [E.KEY_Q, E.KEY_W, E.KEY_E, E.KEY_R, E.KEY_T, E.KEY_Y]
+BOUND_KEYS = {E.KEY_A: "a", E.KEY_S: "s", E.KEY_D: "d"}
+HANDLER_SCRIPT = "return { on_press = function() state.count = (state.count or 0) + 1 end }\n"
+FRAMES = 20000
+WARMUP_READS = 50
+MEASURED_READS = 500
+
+
+class FakeConfig:
+    """The parts of ConfigManager the monitor uses, without QSettings."""
+
+    def __init__(self, **settings):
+        self.snapshot = replace(ConfigSnapshot(), **settings)
+
+    def get_debounce_ms(self) -> int:
+        return self.snapshot.debounce_ms
+
+    def subscribe(self, listener) -> None:
+        pass
+
+    def unsubscribe(self, listener) -> None:
+        pass
+
+
+class MeasuringSource(ReplayInputSource):
+    """Takes a tracemalloc snapshot after the warm-up reads and another one later, then stops the monitor."""
+
+    def __init__(self, path, monitor_holder, journal=None):
+        super().__init__(path, speed=0)
+        self.monitor_holder = monitor_holder
+        self.journal = journal
+        self.reads = 0
+        self.snapshots = []
+
+    def read(self):
+        self.reads += 1
+        if self.reads in (WARMUP_READS, WARMUP_READS + MEASURED_READS):
+            if self.journal is not None:
+                wait_for_writer(self.journal)
+            self.snapshots.append(tracemalloc.take_snapshot())
+            if len(self.snapshots) == 2:
+                self.monitor_holder[0].running = False
+        return super().read()
+
+
+def wait_for_writer(journal):
+    """Let the journal writer catch up, so the entries still queued do not count as growth."""
+    deadline = time.monotonic() + 5
+    while journal._queue and time.monotonic() < deadline:
+        journal._wakeup.set()
+        time.sleep(0.01)
+    time.sleep(0.05)  # the writer returns the last records to the pool after popping them
+
+
+def write_capture(path, codes):
+    """Press and release the given keys in turn, one frame per key edge."""
+    with open(path, "wb") as f:
+        f.write(CAPTURE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, CAPTURE_RECORD.size, 0))
+        timestamp_us = 1_000_000
+        for frame in range(FRAMES):
+            code = codes[(frame // 2) % len(codes)]
+            f.write(CAPTURE_RECORD.pack(timestamp_us, E.EV_MSC, E.MSC_SCAN, code))
+            f.write(CAPTURE_RECORD.pack(timestamp_us, E.EV_KEY, code, 1 - frame % 2))
+            f.write(CAPTURE_RECORD.pack(timestamp_us, E.EV_SYN, E.SYN_REPORT, 0))
+            timestamp_us += 5000
+
+
+def run_monitor(tmp_path, codes, with_journal=False):
+    """Replay presses of codes through the monitor with passthrough on; returns the monitor, source and journal."""
+    capture = tmp_path / "keys.mtkc"
+    write_capture(capture, codes)
+    scripts = tmp_path / "scripts"
+    scripts.mkdir()
+    for name in BOUND_KEYS.values():
+        (scripts / f"{name}.lua").write_text(HANDLER_SCRIPT)
+    script_manager = LuaScriptManager(scripts, recordings_directory=tmp_path / "recordings",
+                                      profiles_directory=tmp_path / "profiles",
+                                      library_directory=tmp_path / "lib")
+    script_manager.lua_available = True
+
+    tracemalloc.start()
+    journal = None
+    try:
+        # Created while tracing, so pooled records that are later swapped for new ones cancel out
+        if with_journal:
+            journal = EventJournal(tmp_path / "journal")
+            journal.start()
+        holder = []
+        source = MeasuringSource(capture, holder, journal)
+        monitor = KeyboardMonitorThread("", script_manager, FakeConfig(passthrough_unbound=True), journal=journal,
+                                        input_source=source)
+        holder.append(monitor)
+        monitor.run()  # on this thread, so the loop runs under tracemalloc
+    finally:
+        tracemalloc.stop()
+        if journal is not None:
+            journal.stop()
+    assert len(source.snapshots) == 2, "the capture ended before both snapshots were taken"
+    return monitor, source, journal
+
+
+def assert_no_growth(source, limit=1024):
+    """Memory allocated by the application's modules must not grow between the two snapshots."""
+    filters = [tracemalloc.Filter(True, str(REPO / "*.py"))]
+    before, after = (snapshot.filter_traces(filters) for snapshot in source.snapshots)
+    stats = after.compare_to(before, "lineno")
+    growth = sum(stat.size_diff for stat in stats)
+    # Hundreds of batches went through; anything kept per event or per batch would show up as kilobytes here
+    assert growth < limit, [str(stat) for stat in stats[:5]]
+
+
+def test_forwarding_unbound_keys_does_not_grow_memory(tmp_path):
+    monitor, source, _ = run_monitor(tmp_path, UNBOUND_KEYS)
+    assert monitor.keys_forwarded >= MEASURED_READS
+    assert monitor.keys_dispatched == 0
+    assert_no_growth(source)
+
+
+def test_dispatching_bound_keys_with_journal_does_not_grow_memory(tmp_path):
+    monitor, source, journal = run_monitor(tmp_path, list(BOUND_KEYS) + UNBOUND_KEYS, with_journal=True)
+    assert monitor.keys_dispatched >= MEASURED_READS
+    assert monitor.keys_forwarded >= MEASURED_READS
+    assert all(monitor.script_manager.profiles.active.handlers[name] for name in BOUND_KEYS.values())
+    assert not journal.take_errors()
+    assert_no_growth(source)
@@ -0,0 +1,153 @@
+import math
+import time
+from typing import Dict, List
+
+
+class Timer:
+    """A scheduled callback. Cancelled timers stay in their slot and are skipped when reached."""
+
+    __slots__ = ("id", "expires", "interval", "callback", "owner", "cancelled")
+
+    def __init__(self, timer_id: int, expires: int, interval: int, callback, owner: str):
+        self.id = timer_id
+        self.expires = expires  # absolute tick
+        self.interval = interval  # ticks between runs, 0 for a one-shot timer
+        self.callback = callback
+        self.owner = owner  # state key of the script that created the timer
+        self.cancelled = False
+
+
+class TimerWheel:
+    """
+    Hierarchical timing wheel for delayed and periodic callbacks.
+
+    Level 0 has one slot per TICK_MS; every higher level has slots covering the
+    whole span of the level below. Scheduling and cancelling are O(1). When the
+    lower levels wrap around, the timers of the next higher slot are moved down
+    ("cascaded"). The wheel has no thread of its own: the owner sleeps at most
+    next_timeout() and then calls advance() to collect the expired timers.
+    """
+
+    TICK_MS = 10
+    BITS = 6
+    SLOTS = 1 << BITS
+    MASK = SLOTS - 1
+    LEVELS = 4  # 64**4 ticks of 10 ms, about 46 hours; later timers wait in the top level
+
+    def __init__(self):
+        self._tick_ns = self.TICK_MS * 1_000_000
+        self._tick = time.monotonic_ns() // self._tick_ns
+        self._wheels = [[[] for _ in range(self.SLOTS)] for _ in range(self.LEVELS)]
+        self._due: List[Timer] = []  # timers whose tick has already passed when inserted
+        self._timers: Dict[int, Timer] = {}  # live timers by id
+        self._next_id = 1
+
+    def __len__(self) -> int:
+        return len(self._timers)
+
+    def schedule(self, delay_ms: float, callback, interval_ms: float = 0, owner: str = "") -> int:
+        """Run callback after delay_ms, then every interval_ms if given. Returns the timer id."""
+        now_tick = time.monotonic_ns() // self._tick_ns
+        expires = max(now_tick + max(1, math.ceil(delay_ms / self.TICK_MS)), self._tick + 1)
+        interval = max(1, math.ceil(interval_ms / self.TICK_MS)) if interval_ms else 0
+        timer = Timer(self._next_id, expires, interval, callback, owner)
+        self._next_id += 1
+        self._timers[timer.id] = timer
+        self._insert(timer)
+        return timer.id
+
+    def cancel(self, timer_id: int) -> bool:
+        """Cancel a timer. Returns False if it does not exist or already ran."""
+        timer = self._timers.pop(timer_id, None)
+        if timer is None:
+            return False
+        timer.cancelled = True
+        return True
+
+    def cancel_all(self) -> int:
+        """Cancel every timer and return how many there were."""
+        count = len(self._timers)
+        for timer in self._timers.values():
+            timer.cancelled = True
+        self._timers.clear()
+        self._due = []
+        return count
+
+    def _insert(self, timer: Timer) -> None:
+        """Put a timer into the slot of the lowest level whose span reaches its expiry."""
+        delta = timer.expires - self._tick
+        if delta <= 0:
+            self._due.append(timer)
+            return
+        for level in range(self.LEVELS):
+            shift = self.BITS * level
+            if delta < 1 << (shift + self.BITS):
+                self._wheels[level][(timer.expires >> shift) & self.MASK].append(timer)
+                return
+        # Beyond the top level: park it in the slot cascaded last; it is re-inserted from there
+        shift = self.BITS * (self.LEVELS - 1)
+        self._wheels[-1][(self._tick >> shift) & self.MASK].append(timer)
+
+    def _cascade(self, tick: int) -> None:
+        """Move the timers of the higher-level slots that start at tick down the hierarchy."""
+        for level in range(1, self.LEVELS):
+            index = (tick >> (self.BITS * level)) & self.MASK
+            slot = self._wheels[level][index]
+            self._wheels[level][index] = []
+            for timer in slot:
+                if not timer.cancelled:
+                    self._insert(timer)
+            if index:
+                break
+
+    def next_timeout(self, limit: float) -> float:
+        """Seconds until the next timer may expire, at most limit."""
+        if self._due:
+            return 0.0
+        if not self._timers:
+            return limit
+        # Scan level 0 up to the next cascade; waking there is cheap if nothing is due
+        offset = self.SLOTS - (self._tick & self.MASK)
+        wheel = self._wheels[0]
+        for step in range(1, offset):
+            if wheel[(self._tick + step) & self.MASK]:
+                offset = step
+                break
+        remaining_ns = (self._tick + offset) * self._tick_ns - time.monotonic_ns()
+        return min(limit, max(0.0, remaining_ns / 1e9))
+
+    def advance(self) -> List[Timer]:
+        """Turn the wheel to the current time and return the timers that expired, in order."""
+        target = time.monotonic_ns() // self._tick_ns
+        expired = self._due
+        self._due = []
+        if not self._timers:
+            # Nothing live is left in the slots, so there is nothing to cascade
+            self._tick = max(self._tick, target)
+            return []
+
+        wheel = self._wheels[0]
+        while self._tick < target:
+            self._tick += 1
+            index = self._tick & self.MASK
+            if not index:
+                self._cascade(self._tick)
+                if self._due:
+                    expired.extend(self._due)
+                    self._due = []
+            if wheel[index]:
+                expired.extend(wheel[index])
+                wheel[index] = []
+
+        fired = []
+        for timer in expired:
+            if timer.cancelled:
+                continue
+            fired.append(timer)
+            if timer.interval:
+                # Periodic timers skip runs they missed instead of firing in a burst
+                timer.expires = max(timer.expires + timer.interval, self._tick + 1)
+                self._insert(timer)
+            else:
+                del self._timers[timer.id]
+        return fired